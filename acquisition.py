@@ -0,0 +1,114 @@
+# Acquisition points in the style of Brown (1973): a morpheme counts as
+# acquired at the first of three consecutive sessions in which the child
+# supplies it in at least 90% of its obligatory contexts.
+#
+# The pipeline does not annotate obligatory contexts, so by default they are
+# approximated from the parents' speech: the number of obligatory contexts in
+# a session is the number of child utterances times the parents' occurrences
+# per utterance, i.e. the supplied/obligatory ratio is the same ratio as in
+# the 'compare' plots. Actual counts of obligatory contexts can be passed
+# instead. Everything is computed on a results cube (see cube.py) for all
+# matchers and children at once.
+
+import csv
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+THRESHOLD = 0.9
+WINDOW = 3  # consecutive sessions
+COLUMNS = ['child', 'matcher', 'age', 'session', 'file', 'rank']
+
+
+# The supplied/obligatory ratio per matcher, child and session (NaN if there
+# are no obligatory contexts). obligatory is an array (matcher, child,
+# session) of obligatory context counts, or None for the approximation from
+# the parents' speech.
+def supplied_ratios(cube, obligatory=None):
+    data = cube.data.astype(float)
+    if obligatory is None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            obligatory = data[..., 0, 1] * data[..., 1, 0] / data[..., 1, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = data[..., 0, 0] / obligatory
+    ratios[~np.isfinite(ratios)] = np.nan
+    return ratios
+
+
+# The index of the session in which each matcher is acquired by each child,
+# i.e. the first session of the first window of consecutive sessions that
+# all reach the threshold (-1 if there is no such window). The sessions of
+# each child must be in the order of their ages (see cube_sessions).
+def acquisition_sessions(ratios, threshold=THRESHOLD, window=WINDOW):
+    n_matchers, n_children, n_sessions = ratios.shape
+    if n_sessions < window:
+        return np.full((n_matchers, n_children), -1, dtype=np.int64)
+    with np.errstate(invalid='ignore'):
+        reached = ratios >= threshold  # NaN -> False
+    windows = sliding_window_view(reached, window, axis=2).all(axis=-1)
+    return np.where(windows.any(axis=-1), windows.argmax(axis=-1), -1)
+
+
+# The sessions of each child of the cube in the order of their ages (and
+# files of the same age by their names, with the padding at the end), as an
+# array (child, session) of session indices. The cube already orders them
+# like this (see cube.ResultsCube.from_file_counts), but the window must
+# never run over sessions in another order.
+def cube_sessions(cube):
+    return np.lexsort((cube.files,
+                       np.where(np.isnan(cube.ages), np.inf, cube.ages)),
+                      axis=1)
+
+
+# The acquisition age (in months) per matcher and child (NaN if the matcher
+# is not acquired).
+def acquisition_ages(cube, sessions):
+    ages = np.full(sessions.shape, np.nan)
+    m, c = np.nonzero(sessions >= 0)
+    ages[m, c] = cube.ages[c, sessions[m, c]]
+    return ages
+
+
+# The order of acquisition per child: the rank (0 = acquired first) of each
+# matcher and child, or -1 if the matcher is not acquired. Matchers that are
+# acquired at the same age share the rank of the first of them.
+def acquisition_ranks(ages):
+    ordered = np.where(np.isnan(ages), np.inf, ages)
+    # The number of matchers acquired earlier by the same child.
+    ranks = (ordered[None, :, :] < ordered[:, None, :]).sum(axis=1)
+    return np.where(np.isnan(ages), -1, ranks)
+
+
+# The acquisition age, session, file and rank of each matcher for each child,
+# as rows (see COLUMNS), sorted by child and rank.
+def acquisition_table(cube, obligatory=None, threshold=THRESHOLD,
+                      window=WINDOW):
+    order = cube_sessions(cube)
+    children = np.arange(len(cube.children))[:, None]
+    ordered = acquisition_sessions(
+        supplied_ratios(cube, obligatory)[:, children, order], threshold,
+        window)
+    # The index of the session in the cube.
+    sessions = np.where(ordered >= 0,
+                        order[children[:, 0], np.maximum(ordered, 0)], -1)
+    ages = acquisition_ages(cube, sessions)
+    ranks = acquisition_ranks(ages)
+    rows = []
+    for c, child in enumerate(cube.children):
+        for m in np.argsort(np.where(ranks[:, c] < 0, len(cube.matchers),
+                                     ranks[:, c]), kind='stable'):
+            acquired = sessions[m, c] >= 0
+            rows.append((child, cube.matchers[m],
+                         int(ages[m, c]) if acquired else None,
+                         int(sessions[m, c]) if acquired else None,
+                         str(cube.files[c, sessions[m, c]]) if acquired
+                         else None,
+                         int(ranks[m, c]) if acquired else None))
+    return rows
+
+
+def save_acquisition_table(rows, filename):
+    with open(filename, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
@@ -1,124 +1,949 @@
+import argparse
 import glob
+import logging
+import os
 import sys
-# Imports from other files in this directory:
-from corpusreader import CHILDESMorphFileReader
-from match import Matcher, SentenceMatcher
-from visualize import visualize
+import time
+from functools import partial
+# Imports from other files in this directory. Modules that import NLTK, NumPy
+# or matplotlib are only imported by the functions that need them, so that
+# the commands start quickly.
+from archive import archive_files, file_stat
+from cache import CACHE_DIR, PARSER_VERSION, file_hash
+from incremental import IncrementalStore
+import logsink
+from logsink import logger
+from manifest import build_manifest, save_manifest
+from match import load_matchers, matcher_from_dict
+from profiling import profiler
+from queryplan import QueryPlan
+from results import add_corpus_counts, add_counts, corpus_name
 
 
 DATA_PATH = 'data'
 AGE_ERROR_MSG = 'Age is None. Skipping file'
+CHILD = 'CHI'
+PARENTS = ['MOT', 'FAT']
+MAX_AGE = 60  # in months
+INCREMENTAL_PATH = 'output/incremental.json'
+SAVE_INTERVAL = 30  # seconds between saves of the incremental store
+PROFILE_PATH = 'output/profile.json'
+RESULTS_PATH = 'output/results.json'
+OUTPUT_DIR = 'output'
+# The matcher definitions (see match.load_matchers).
+MATCHERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'matchers.json')
 
 
-def analyze_sentence(speaker, matcher, sent, verbose):
-    occ = 0
-    if isinstance(matcher, SentenceMatcher):
-        if matcher.match(sent):
-            occ += 1
-            if verbose:
-                print(speaker, ':', ' '.join([word.form for word in sent]))
-                print(sent)
-    else:
-        for entry in sent:
-            if matcher.match(entry):
-                occ += 1
-                if verbose:
-                    print(speaker, ':', ' '.join([word.form for word in sent]))
-                    print(sent)
-    return occ
+def print_sentence(speaker, sent):
+    with profiler.timer('printing'):
+        logger.debug('%s : %s\n%s', speaker,
+                     ' '.join([word.form for word in sent]), sent)
 
 
 def count_occurrences(corpus, matcher, results, verbose=True):
-    age = corpus.age(month=True)[0]  # age in months
+    return count_occurrences_batch(corpus, [matcher], results, verbose)
+
+
+# Evaluates all matchers in a single pass over the corpus file.
+def count_occurrences_batch(corpus, matchers, results, verbose=True):
+    age, counts = count_file(corpus, matchers, verbose)
+    if counts is None:
+        return results
+    # Add the numbers of utterances/occurrences to the results dictionary.
+    return add_counts(results, matchers, age, counts)
+
+
+# Returns the age (in months) and, if the file is not skipped, the list of
+# [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par] counts for each matcher.
+# If the age is already known (see manifest.py), it can be passed as an
+# argument.
+def count_file(corpus, matchers, verbose=True, age=None):
+    if age is None:
+        with profiler.timer('age'):
+            age = corpus.age(speaker=CHILD, month=True)[0]  # in months
     if verbose:
-        print(matcher)
-        print(corpus.fileids(), age)
+        logger.info('%s %s', corpus.fileids(), age)
     if age is None:
-        print(AGE_ERROR_MSG)
-        sys.stderr.write('{}(s) {}.\n'.format(AGE_ERROR_MSG, corpus.fileids()))
-        return results
-    if age > 60:  # Data sparsity.
-        print('Skipping file (age > 60 months).')
-        return results
+        logger.warning('%s(s) %s.', AGE_ERROR_MSG, corpus.fileids())
+        return age, None
+    if age > MAX_AGE:  # Data sparsity.
+        logger.info('Skipping file (age > %d months).', MAX_AGE)
+        return age, None
 
     n_utt_chi = 0  # number of utterances by the child
-    n_occ_chi = 0  # number of occurrences of the feature in the child's speech
-    for sent in corpus.tagged_morph_sents(speaker='CHI',
-                                          strip_space=True
-                                          ):
-        n_utt_chi += 1
-        n_occ_chi += analyze_sentence('CHI', matcher, sent, verbose)
-
     n_utt_par = 0  # number of utterances by the parent(s)
-    n_occ_par = 0  # number of occurrences of the feature in the parent's speech
-    for sent in corpus.tagged_morph_sents(speaker=['MOT', 'FAT'],
-                                          strip_space=True
-                                          ):
-        n_utt_par += 1
-        n_occ_par += analyze_sentence('PAR', matcher, sent, verbose)
-
-    # Add the numbers of utterances/occurrences to the results dictionary.
-    if n_utt_chi > 0:
-        matcher_str = matcher.label
-        try:  # Try to update an existing entry.
-            prev_counts = results[matcher_str][age]
-            results[matcher_str][age] = \
-                [sum(x) for x in zip(prev_counts,
-                                     (n_occ_chi, n_utt_chi,
-                                      n_occ_par, n_utt_par))]
-        except KeyError:  # New entry for results[matcher_str][age].
-            try:
-                results[matcher_str][age] = [n_occ_chi, n_utt_chi,
-                                             n_occ_par, n_utt_par]
-            except KeyError:  # New entry for results[matcher_str].
-                results[matcher_str] = \
-                    {age: [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par]}
+    # Number of occurrences of each feature in the child's/parents' speech.
+    n_occ_chi = [0] * len(matchers)
+    n_occ_par = [0] * len(matchers)
+    timed = profiler.enabled
+    # Only format the matched sentences if they are logged.
+    log_sents = verbose and logger.isEnabledFor(logging.DEBUG)
+    # All matchers are evaluated together (see queryplan.py).
+    plan = QueryPlan(matchers)
+    # The time spent on the checks of each matcher (if profiling).
+    matcher_seconds = [0.0] * len(matchers) if timed else None
+    for speaker, sent in profiler.timed_iter(
+            'reading', corpus.iter_morph_sents(speaker=[CHILD] + PARENTS,
+                                               strip_space=True,
+                                               keep_speaker=True)):
+        if speaker == CHILD:
+            n_utt_chi += 1
+            role, n_occ = 'CHI', n_occ_chi
+        else:
+            n_utt_par += 1
+            role, n_occ = 'PAR', n_occ_par
+        if timed:
+            profiler.count('tokens', len(sent))
+            start = time.perf_counter()
+        occ = plan.count(sent, matcher_seconds)
+        if timed:
+            profiler.add_time('matching', time.perf_counter() - start)
+        for i, n in enumerate(occ):
+            n_occ[i] += n
+            if log_sents:
+                for _ in range(n):
+                    print_sentence(role, sent)
+    profiler.count('utterances', n_utt_chi + n_utt_par)
+    if timed:
+        for matcher, seconds in zip(matchers, matcher_seconds):
+            profiler.add_matcher_time(matcher.label, seconds)
 
     if verbose:
-        print('CHI: {} occurrences | {} utterances | ratio: {}'
-              .format(n_occ_chi, n_utt_chi, n_occ_chi / n_utt_chi
-                      if n_utt_chi > 0 else -1))
-        print('PAR: {} occurrences | {} utterances | ratio: {}'
-              .format(n_occ_par, n_utt_par, n_occ_par / n_utt_par
-                      if n_utt_par > 0 else -1))
-        print()
+        for i, matcher in enumerate(matchers):
+            logger.info(
+                '%s\nCHI: %d occurrences | %d utterances | ratio: %s\n'
+                'PAR: %d occurrences | %d utterances | ratio: %s\n',
+                matcher, n_occ_chi[i], n_utt_chi,
+                n_occ_chi[i] / n_utt_chi if n_utt_chi > 0 else -1,
+                n_occ_par[i], n_utt_par,
+                n_occ_par[i] / n_utt_par if n_utt_par > 0 else -1,
+                extra={'data': {'files': corpus.fileids(), 'age': age,
+                                'matcher': matcher.label,
+                                'counts': [n_occ_chi[i], n_utt_chi,
+                                           n_occ_par[i], n_utt_par]}})
+    return age, [[n_occ_chi[i], n_utt_chi, n_occ_par[i], n_utt_par]
+                 for i in range(len(matchers))]
+
+
+# If the path of a corpus store is given (see corpusstore.py), the file is
+# read from the store instead of the XML file.
+def analyze_file(f, matchers, age=None, verbose=True, cache_dir=None,
+                 store=None):
+    start = time.perf_counter()
+    if store is None:
+        from corpusreader import CHILDESMorphFileReader
+        corpus = CHILDESMorphFileReader(DATA_PATH, f, cache_dir=cache_dir)
+    else:
+        from corpusstore import open_store
+        corpus = open_store(store).view(f)
+    age, counts = count_file(corpus, matchers, verbose, age)
+    profiler.count('files')
+    if counts is None:
+        profiler.count('skipped files')
+        profiler.add_file(f, time.perf_counter() - start)
+    else:
+        profiler.add_file(f, time.perf_counter() - start,
+                          utterances=counts[0][1] + counts[0][3])
+    return age, counts
+
+
+# Runs analyze_file in a worker process and also returns the profile.
+def profile_file(f, matchers, age=None, verbose=True, cache_dir=None,
+                 store=None):
+    profiler.enabled = True
+    profiler.reset()
+    return (analyze_file(f, matchers, age, verbose, cache_dir, store),
+            profiler.report())
+
+
+# Returns the (age, counts) tuples of all files (see count_file). If a list of
+# matchers per file is given, only these matchers are evaluated for each file.
+# The ages of the files can be given as a dictionary (see select_files).
+def map_files(files, matchers, jobs=1, verbose=True, cache_dir=None,
+              file_matchers=None, ages=None, store=None):
+    return list(iter_files(files, matchers, jobs, verbose, cache_dir,
+                           file_matchers, ages, store))
+
+
+# Like map_files, but yields the (age, counts) tuple of each file as soon as
+# it (and all files before it) are analyzed.
+def iter_files(files, matchers, jobs=1, verbose=True, cache_dir=None,
+               file_matchers=None, ages=None, store=None):
+    if file_matchers is None:
+        file_matchers = [matchers] * len(files)
+    if ages is None:
+        ages = {}
+    file_ages = [ages.get(f) for f in files]
+    if jobs == 1:
+        for f, m, age in zip(files, file_matchers, file_ages):
+            yield analyze_file(f, m, age, verbose, cache_dir, store)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    # The results are returned in the same order as in the serial run, so
+    # the output does not depend on the number of workers.
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(settings(),) + logsink.worker_args()
+                             ) as executor:
+        if not profiler.enabled:
+            yield from executor.map(partial(analyze_file, verbose=verbose,
+                                            cache_dir=cache_dir, store=store),
+                                    files, file_matchers, file_ages)
+            return
+        for counts, report in executor.map(partial(profile_file,
+                                                   verbose=verbose,
+                                                   cache_dir=cache_dir,
+                                                   store=store),
+                                           files, file_matchers, file_ages):
+            profiler.merge(report)
+            yield counts
+
+
+# If a corpus_results dictionary is given, the results of each corpus are
+# also added to it (see results.add_corpus_counts), and if a file_results
+# list is given, the (file, age, counts) tuple of each file is appended to it
+# (see cube.py).
+def analyze_files(files, matchers, jobs=1, verbose=True, cache_dir=None,
+                  ages=None, store=None, corpus_results=None,
+                  file_results=None):
+    # Results:
+    # {query -> {age -> [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par]}}
+    results = {}
+    for f, (age, counts) in zip(files, map_files(files, matchers, jobs,
+                                                 verbose, cache_dir,
+                                                 ages=ages, store=store)):
+        if file_results is not None:
+            file_results.append((f, age, counts))
+        if counts is not None:
+            results = add_counts(results, matchers, age, counts)
+            if corpus_results is not None:
+                add_corpus_counts(corpus_results, f, matchers, age, counts)
     return results
 
 
-matchers = [Matcher('1. present participle', infl='PRESP'),
-            Matcher('2./3. in', form='in'),
-            Matcher('2./3. out', form='on'),
-            Matcher('4. plural (regular)', infl_affix='PL', suffix='s'),
-            Matcher('5. simple past (irregular)', infl_fusion='PAST'),
-            Matcher('6. possessive -\'s/-s\'', post_rel='POSS',
-                    suffix=['\'s', 's\'']),
-            SentenceMatcher(Matcher('7. copula \'be\' (uncontractible)',
-                                    tag='cop', stem='be',
-                                    rel=['ROOT', 'COMP', 'INCROOT']),
-                            'uncontractible'),
-            Matcher('8. articles', form=['the', 'a', 'an']),
-            Matcher('9. simple past (regular)', infl_affix='PAST',
-                    suffix='ed'),
-            Matcher('10. 3.SG.PRES (regular)', infl_affix='3S', suffix='s'),
-            Matcher('11. 3.SG.PRES (irregular)', tag='v', infl_fusion='3S'),
-            SentenceMatcher(Matcher('12. auxiliary \'be\' (uncontractible)',
-                                    tag='aux', stem='be'),
-                            'uncontractible'),
-            Matcher('13. copula \'be\' (contractible)', sfx_tag='cop',
-                    sfx='be', post_rel=['ROOT', 'COMP', 'INCROOT']),
-            Matcher('14. auxiliary \'be\' (contractible)', sfx_tag='aux',
-                    sfx='be', post_rel='AUX')
-            ]
-
-# Results:
-# {query -> {age -> [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par]}}
-results = {}
-for f in glob.glob('data/**/*.xml'):
-    f = f.replace('\\', '/')[5:]
-    for matcher in matchers:
-        results = count_occurrences(CHILDESMorphFileReader(DATA_PATH, f),
-                                    matcher,
-                                    results)
-
-visualize(results, compare_adult=False, filename='output/total', display=False)
-visualize(results, compare_adult=True, filename='output/compare', display=False)
+# Like analyze_files, but only evaluates the (file, matcher) pairs that are
+# not yet in the incremental store at the given path (see incremental.py).
+# The store is saved every SAVE_INTERVAL seconds and when the run stops (also
+# because of an error), so that an interrupted run can be resumed.
+def analyze_incremental(files, matchers, path, jobs=1, verbose=True,
+                        cache_dir=None, ages=None, store=None,
+                        corpus_results=None, file_results=None):
+    inc_store = IncrementalStore(path, {'child': CHILD, 'parents': PARENTS,
+                                    'max_age': MAX_AGE,
+                                    'parser_version': PARSER_VERSION})
+    todo = []
+    for f in files:
+        missing = inc_store.missing(f, os.path.join(DATA_PATH, f),
+                                    matchers)
+        if missing:
+            todo.append((f, missing))
+    if verbose:
+        logger.info('Incremental run: %d of %d files need to be '
+                    '(re-)analyzed.', len(todo), len(files))
+    todo_files = [f for f, _ in todo]
+    todo_matchers = [missing for _, missing in todo]
+    last_save = time.perf_counter()
+    try:
+        for f, missing, (age, counts) in zip(
+                todo_files, todo_matchers,
+                iter_files(todo_files, matchers, jobs, verbose, cache_dir,
+                           todo_matchers, ages, store)):
+            inc_store.update(f, os.path.join(DATA_PATH, f), missing, age,
+                             counts)
+            if time.perf_counter() - last_save > SAVE_INTERVAL:
+                inc_store.save(files, matchers)
+                last_save = time.perf_counter()
+    finally:
+        inc_store.save(files, matchers)
+    if file_results is not None:
+        file_results.extend((f, age, counts) for f, (age, counts)
+                            in zip(files, inc_store.file_counts(files,
+                                                                matchers)))
+    if corpus_results is not None:
+        corpus_files = {}
+        for f in files:
+            corpus_files.setdefault(corpus_name(f), []).append(f)
+        corpus_files.pop(None, None)
+        for corpus, fs in corpus_files.items():
+            corpus_results[corpus] = inc_store.results(fs, matchers)
+    return inc_store.results(files, matchers)
+
+
+# Like analyze_files, but using a token table (see tokentable.py) or an
+# inverted index (table_cls=CorpusIndex, see index.py). The table is loaded
+# from the given path or, if it does not exist yet, created from the files
+# and saved there. Only the given files are counted, even if the stored table
+# contains other files (e.g. those of other shards, see shards.py).
+def analyze_table(files, matchers, path, cache_dir=None,
+                  table_cls=None, ages=None, corpus_results=None,
+                  file_results=None):
+    if table_cls is None:
+        from tokentable import TokenTable as table_cls
+    if os.path.isdir(path):
+        check_table(path, files)
+        with profiler.timer('table loading'):
+            table = table_cls.load(path)
+    else:
+        table = build_table(files, path, cache_dir, table_cls, ages)
+    profiler.count('tokens', len(table))
+    profiler.count('utterances', table.n_utterances())
+    profiler.count('files', len(table.files))
+    with profiler.timer('matching'):
+        return table.count_occurrences(matchers, {}, CHILD, PARENTS,
+                                       MAX_AGE, corpus_results, file_results,
+                                       files)
+
+
+# Creates a token table (or a subclass, e.g. CorpusIndex) for the files and
+# saves it at the given path.
+def build_table(files, path, cache_dir=None, table_cls=None, ages=None):
+    from corpusreader import CHILDESMorphFileReader
+    if table_cls is None:
+        from tokentable import TokenTable as table_cls
+    with profiler.timer('table building'):
+        table = table_cls.from_corpus(
+            CHILDESMorphFileReader(DATA_PATH, files, cache_dir=cache_dir),
+            ages=ages)
+        table.save(path, table_provenance(files))
+    return table
+
+
+# What a stored table (or corpus store) was created from: the parser version,
+# the speaker code of the child whose ages it contains, and the size,
+# modification time and content hash of each file.
+def table_provenance(files):
+    provenance = {'parser_version': PARSER_VERSION, 'child': CHILD,
+                  'files': {}}
+    for f in files:
+        path = os.path.join(DATA_PATH, f)
+        size, mtime = file_stat(path)
+        provenance['files'][f] = {'size': size, 'mtime': mtime,
+                                  'sha1': file_hash(path)}
+    return provenance
+
+
+# Why the table (or corpus store) stored at the given path cannot be used for
+# the files (all files in the table if files is None): it was created by
+# another parser version or for another child, or does not contain the
+# current version of each of the files. Returns None if it can be used. Like
+# cache.load, the content hash of a file is only computed if its size or
+# modification time changed.
+def table_problem(path, files=None):
+    from tokentable import TokenTable
+    provenance = TokenTable.load_provenance(path)
+    if provenance is None:
+        return 'was created without the sizes and hashes of the files'
+    if provenance['parser_version'] != PARSER_VERSION:
+        return 'was created by another parser version'
+    if provenance['child'] != CHILD:
+        return 'contains the ages of another child ({})'.format(
+            provenance['child'])
+    if files is None:
+        files = provenance['files']
+    missing = set(files) - set(provenance['files'])
+    if missing:
+        return 'does not contain {} of the files (e.g. {})'.format(
+            len(missing), min(missing))
+    for f in files:
+        entry = provenance['files'][f]
+        file_path = os.path.join(DATA_PATH, f)
+        try:
+            if file_stat(file_path) != (entry['size'], entry['mtime']) \
+               and file_hash(file_path) != entry['sha1']:
+                return 'contains an old version of {}'.format(f)
+        except FileNotFoundError:
+            return 'contains {}, which no longer exists'.format(f)
+    return None
+
+
+# Exits if the table (or corpus store) stored at the given path cannot be
+# used for the files (see table_problem).
+def check_table(path, files=None, name='table'):
+    problem = table_problem(path, files)
+    if problem is not None:
+        sys.exit('The {} in {} {}; delete the directory to rebuild it.'
+                 .format(name, path, problem))
+
+
+# Creates a corpus store (see corpusstore.py) for the files at the given path,
+# unless it already exists. An existing store must contain the current
+# version of each of the files (see check_table).
+def build_store(files, path, cache_dir=None, ages=None):
+    if os.path.isdir(path):
+        check_table(path, files, 'corpus store')
+        return
+    from corpusreader import CHILDESMorphFileReader
+    from corpusstore import CorpusStore
+    with profiler.timer('store building'):
+        CorpusStore.from_corpus(
+            CHILDESMorphFileReader(DATA_PATH, files, cache_dir=cache_dir),
+            ages=ages).save(path, table_provenance(files))
+
+
+# Parses a file and stores it in the cache (see cache.py).
+def cache_file(f, cache_dir):
+    from corpusreader import CHILDESMorphFileReader
+    for _ in CHILDESMorphFileReader(DATA_PATH, f,
+                                    cache_dir=cache_dir).iter_morph_sents():
+        pass
+
+
+def cache_files(files, cache_dir, jobs=1):
+    with profiler.timer('caching'):
+        if jobs == 1:
+            for f in files:
+                cache_file(f, cache_dir)
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(settings(),)
+                                 + logsink.worker_args()) as executor:
+            list(executor.map(partial(cache_file, cache_dir=cache_dir),
+                              files))
+
+
+# Scans the headers of the files (see manifest.py) and returns the files
+# that should be analyzed (i.e. the child's age is known and at most MAX_AGE
+# months), as well as dictionaries with their ages and the names of the
+# children (see cube.child_name). The utterances of the
+# selected files are only counted if the manifest is saved.
+def select_files(files, manifest_path=None):
+    if manifest_path:
+        select = lambda age: age is not None and age <= MAX_AGE
+    else:
+        select = lambda age: False
+    with profiler.timer('manifest'):
+        manifest = build_manifest(DATA_PATH, files, CHILD, select)
+    if manifest_path:
+        save_manifest(manifest, manifest_path)
+    selected = []
+    ages = {}
+    names = {}
+    for entry in manifest:
+        if entry['age'] is None:
+            logger.warning('%s(s) %s.', AGE_ERROR_MSG, [entry['file']])
+        elif entry['age'] > MAX_AGE:  # Skip older children (data sparsity).
+            logger.info('Skipping file (age > %d months).', MAX_AGE)
+        else:
+            selected.append(entry['file'])
+            ages[entry['file']] = entry['age']
+            names[entry['file']] = entry['name']
+    profiler.count('skipped files', len(files) - len(selected))
+    logger.info('Selected %d of %d files (age known and <= %d months).',
+                len(selected), len(files), MAX_AGE)
+    return selected, ages, names
+
+
+# The settings that apply to all files and can be changed on the command line
+# (see configure). They are passed to the worker processes by init_worker.
+def settings():
+    return DATA_PATH, CHILD, PARENTS, MAX_AGE
+
+
+def configure(data_path, child, parents, max_age):
+    global DATA_PATH, CHILD, PARENTS, MAX_AGE
+    DATA_PATH = data_path
+    CHILD = child
+    PARENTS = list(parents)
+    MAX_AGE = max_age
+
+
+# The initializer of the worker processes (see map_files).
+def init_worker(worker_settings, *log_args):
+    configure(*worker_settings)
+    logsink.init_worker(*log_args)
+
+
+# The XML files in the subdirectories of the data directory, at any depth
+# (relative to it), including the XML files in zip and tar archives in the
+# data directory (see archive.py).
+def data_files():
+    pattern = os.path.join(DATA_PATH, '*', '**', '*.xml')
+    return sorted([os.path.relpath(f, DATA_PATH).replace('\\', '/')
+                   for f in glob.glob(pattern, recursive=True)]
+                  + archive_files(DATA_PATH))
+
+
+# --- Commands (see main).
+
+# Counts the occurrences and returns the results, the results of each corpus
+# (or None) and the results cube (or None, see cube.py). If a file_results
+# list is given, the (file, age, counts) tuple of each file is appended to it,
+# and if a names dictionary is given, the names of the children are added to
+# it (see select_files). With args.shard, only the files of that shard are
+# counted (see shards.py).
+def count(args, matchers, file_results=None, names=None):
+    files = data_files()
+    if getattr(args, 'shard', None):
+        from shards import shard_files
+        files = shard_files(files, *args.shard)
+    files, ages, file_names = select_files(files, args.manifest)
+    if names is not None:
+        names.update(file_names)
+    if args.store:
+        build_store(files, args.store, args.cache, ages)
+    # {corpus -> results}
+    corpus_results = {} if getattr(args, 'corpora', False) else None
+    # (file, age, counts) for the results cube.
+    if file_results is None and (args.cube or args.acquisition
+                                 or getattr(args, 'bands', None)):
+        file_results = []
+    if args.index:
+        from index import CorpusIndex
+        results = analyze_table(files, matchers, args.index, args.cache,
+                                CorpusIndex, ages, corpus_results,
+                                file_results)
+    elif args.table:
+        results = analyze_table(files, matchers, args.table, args.cache,
+                                ages=ages, corpus_results=corpus_results,
+                                file_results=file_results)
+    elif args.incremental:
+        results = analyze_incremental(files, matchers, args.incremental,
+                                      args.jobs, cache_dir=args.cache,
+                                      ages=ages, store=args.store,
+                                      corpus_results=corpus_results,
+                                      file_results=file_results)
+    else:
+        results = analyze_files(files, matchers, args.jobs,
+                                cache_dir=args.cache, ages=ages,
+                                store=args.store,
+                                corpus_results=corpus_results,
+                                file_results=file_results)
+    cube = None
+    if args.cube or args.acquisition or getattr(args, 'bands', None):
+        from cube import ResultsCube
+        cube = ResultsCube.from_file_counts(matchers, file_results,
+                                            file_names)
+        if args.cube:
+            cube.export(args.cube)
+        if args.acquisition:
+            from acquisition import acquisition_table, save_acquisition_table
+            save_acquisition_table(acquisition_table(cube), args.acquisition)
+    return results, corpus_results, cube
+
+
+# The confidence bands for a plot of the results (of the given corpus), or
+# None if they are not requested (see bootstrap.py).
+def plot_bands(cube, compare_adult, args, corpus=None):
+    if not args.bands:
+        return None
+    from bootstrap import RESAMPLES, confidence_bands
+    with profiler.timer('bootstrapping'):
+        if corpus is not None:
+            cube = cube.select_corpus(corpus)
+        return confidence_bands(cube, compare_adult,
+                                RESAMPLES if args.bands is True
+                                else args.bands, jobs=args.jobs)
+
+
+# Plots the results (and the results of each corpus) to args.output_dir.
+def plot(args, results, corpus_results=None, cube=None):
+    from visualize import render_plots
+    # (results, compare_adult, filename, bands) for each plot.
+    plots = []
+    for compare_adult, name in ((False, 'total'), (True, 'compare')):
+        plots.append((results, compare_adult,
+                      os.path.join(args.output_dir, name),
+                      plot_bands(cube, compare_adult, args)))
+    for corpus, res in sorted((corpus_results or {}).items()):
+        for compare_adult, name in ((False, 'total'), (True, 'compare')):
+            plots.append((res, compare_adult,
+                          os.path.join(args.output_dir,
+                                       '{}_{}'.format(name, corpus)),
+                          plot_bands(cube, compare_adult, args, corpus)))
+    with profiler.timer('plotting'):
+        render_plots(plots)
+
+
+# Analyzes the files and plots the results.
+def run(args):
+    results, corpus_results, cube = count(args, load_matchers(args.matchers))
+    plot(args, results, corpus_results, cube)
+
+
+# Saves the counts per file (of all files or of one shard) with their
+# provenance to a result file (see shards.py).
+def run_count(args):
+    from shards import build_shard, save_shard
+    matchers = load_matchers(args.matchers)
+    file_results = []
+    names = {}
+    count(args, matchers, file_results, names)
+    with profiler.timer('hashing'):
+        hashes = {f: file_hash(os.path.join(DATA_PATH, f))
+                  for f, _, _ in file_results}
+    shard, n_shards = args.shard or (0, 1)
+    save_shard(args.output, build_shard(
+        file_results, hashes, names, matchers,
+        {'child': CHILD, 'parents': PARENTS, 'max_age': MAX_AGE,
+         'parser_version': PARSER_VERSION}, shard, n_shards))
+    logger.info('Saved the counts of %d files to %s.', len(file_results),
+                args.output)
+
+
+# Merges the result files of several shards.
+def run_merge(args):
+    from shards import load_shard, merge_shards, missing_shards, save_shard
+    try:
+        merged = merge_shards([load_shard(f) for f in args.files])
+    except ValueError as e:
+        sys.exit(str(e))
+    missing = missing_shards(merged)
+    if missing and not args.partial:
+        sys.exit('Missing shard(s): {} (use --partial to merge anyway).'
+                 .format(', '.join(str(i) for i in missing)))
+    save_shard(args.output, merged)
+    logger.info('Merged %d files from %d shard(s) to %s.',
+                len(merged['files']), len(merged['shards']), args.output)
+
+
+# Plots the results saved by the count (or merge) command, or the results in
+# a cube.
+def run_plot(args):
+    cube = None
+    if args.cube:
+        from cube import ResultsCube
+        cube = ResultsCube.load(args.cube)
+        results = cube.to_results()
+        corpus_results = {}
+        if args.corpora:
+            for corpus in sorted(set(cube.child_corpora()) - {None}):
+                corpus_results[corpus] = \
+                    cube.select_corpus(corpus).to_results()
+    else:
+        from shards import (load_shard, missing_shards, shard_file_counts,
+                            shard_matchers, shard_names, shard_results)
+        try:
+            shard = load_shard(args.results)
+        except ValueError as e:
+            sys.exit(str(e))
+        missing = missing_shards(shard)
+        if missing:
+            logger.warning('The results do not contain the shard(s) %s.',
+                           ', '.join(str(i) for i in missing))
+        corpus_results = {} if args.corpora else None
+        results = shard_results(shard, corpus_results)
+        if args.bands:
+            from cube import ResultsCube
+            cube = ResultsCube.from_file_counts(shard_matchers(shard),
+                                                shard_file_counts(shard),
+                                                shard_names(shard))
+    plot(args, results, corpus_results, cube)
+
+
+# Parses the files into the cache, a corpus store and/or a token table.
+def run_extract(args):
+    files, ages, _ = select_files(data_files(), args.manifest)
+    if args.cache:
+        cache_files(files, args.cache, args.jobs)
+    if args.store:
+        build_store(files, args.store, args.cache, ages)
+    if args.table:
+        build_table(files, args.table, args.cache, ages=ages)
+
+
+def run_index(args):
+    from index import CorpusIndex
+    files, ages, _ = select_files(data_files(), args.manifest)
+    index = build_table(files, args.path, args.cache, CorpusIndex, ages)
+    logger.info('Indexed %d tokens in %d files.', len(index),
+                len(index.files))
+
+
+# Prints the locations of a matcher (given as FIELD=VALUE constraints or as
+# the label of one of the matchers) in an index.
+def run_query(args):
+    if args.label:
+        matchers = [matcher for matcher in load_matchers(args.matchers)
+                    if matcher.label == args.label]
+        if not matchers:
+            sys.exit('No matcher with the label {}.'.format(args.label))
+        matcher = matchers[0]
+    else:
+        definition = {'label': 'query'}
+        for constraint in args.constraints:
+            field, _, value = constraint.partition('=')
+            definition[field] = value.split(',') if ',' in value else value
+        try:
+            matcher = matcher_from_dict(definition)
+        except ValueError as e:
+            sys.exit(str(e))
+    if hasattr(matcher, 'condition'):
+        sys.exit('Sentence-level matchers cannot be queried.')
+    from index import CorpusIndex
+    check_table(args.path)
+    locations = CorpusIndex.load(args.path, mmap=True).find(matcher)
+    if args.speaker:
+        locations = [loc for loc in locations if loc[3] in args.speaker]
+    for loc in locations[:args.limit]:
+        print('\t'.join(str(x) for x in loc))
+    logger.info('%d occurrences.', len(locations))
+
+
+# Keeps an inverted index of the files in memory and answers queries over
+# HTTP (see server.py). The index is loaded from args.index if it exists, and
+# otherwise created (and saved there if args.index is given).
+def run_serve(args):
+    from index import CorpusIndex
+    from server import QueryEngine, serve
+    if args.index and os.path.isdir(args.index):
+        check_table(args.index)
+        with profiler.timer('table loading'):
+            index = CorpusIndex.load(args.index)
+    else:
+        files, ages, _ = select_files(data_files(), args.manifest)
+        if args.index:
+            index = build_table(files, args.index, args.cache, CorpusIndex,
+                                ages)
+        else:
+            from corpusreader import CHILDESMorphFileReader
+            with profiler.timer('table building'):
+                index = CorpusIndex.from_corpus(
+                    CHILDESMorphFileReader(DATA_PATH, files,
+                                           cache_dir=args.cache), ages=ages)
+    serve(QueryEngine(index, CHILD, PARENTS, MAX_AGE, args.cache_size),
+          args.host, args.port)
+
+
+COMMANDS = {'run': run, 'count': run_count, 'plot': run_plot,
+            'extract': run_extract, 'index': run_index, 'query': run_query,
+            'serve': run_serve, 'merge': run_merge}
+
+
+# Parses the I/N argument of --shard.
+def parse_shard(value):
+    try:
+        shard, n_shards = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, e.g. 0/4')
+    if not 0 <= shard < n_shards:
+        raise argparse.ArgumentTypeError('expected 0 <= I < N')
+    return shard, n_shards
+
+
+# Creates the missing directories of the files and plots that the command
+# writes (for the plot command, --cube is an input file).
+def make_output_dirs(args):
+    paths = [getattr(args, name, None) for name in
+             ('output', 'profile', 'log', 'manifest', 'incremental',
+              'acquisition')]
+    if args.command != 'plot':
+        paths.append(getattr(args, 'cube', None))
+    dirs = [os.path.dirname(path) for path in paths if path]
+    dirs.append(getattr(args, 'output_dir', None))
+    for directory in dirs:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+
+def build_parser():
+    # The options of all commands.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--data', metavar='DIR', default=DATA_PATH,
+                        help='the directory with the XML files '
+                             '(default: %(default)s)')
+    common.add_argument('--child', metavar='CODE', default=CHILD,
+                        help='the speaker code of the child '
+                             '(default: %(default)s)')
+    common.add_argument('--parents', metavar='CODE', nargs='+',
+                        default=PARENTS,
+                        help='the speaker codes of the adults '
+                             '(default: {})'.format(' '.join(PARENTS)))
+    common.add_argument('--max-age', metavar='MONTHS', type=int,
+                        default=MAX_AGE,
+                        help='skip the files of older children '
+                             '(default: %(default)s)')
+    common.add_argument('--matchers', metavar='FILE', default=MATCHERS_PATH,
+                        help='load the matchers from this file (JSON, TOML '
+                             'or YAML, default: matchers.json)')
+    common.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of worker processes')
+    common.add_argument('--profile', metavar='FILE', nargs='?',
+                        default=None, const=PROFILE_PATH,
+                        help='measure the time spent in the different '
+                             'stages and write a JSON report to this file '
+                             '(default: {})'.format(PROFILE_PATH))
+    common.add_argument('--log', metavar='FILE', default=None,
+                        help='also write the log messages to this file (one '
+                             'JSON object per line)')
+    common.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING'],
+                        help='DEBUG also logs every matched sentence '
+                             '(default: INFO)')
+    common.add_argument('--log-sample', metavar='N', type=int, default=1,
+                        help='only log every N-th matched sentence')
+
+    # The options for reading the files.
+    reading = argparse.ArgumentParser(add_help=False)
+    reading.add_argument('--cache', metavar='DIR', nargs='?', default=None,
+                         const=CACHE_DIR,
+                         help='cache the parsed files in this directory '
+                              '(default: {})'.format(CACHE_DIR))
+    reading.add_argument('--manifest', metavar='FILE', default=None,
+                         help='save the metadata (ages, speakers, utterance '
+                              'counts) of the files to this file')
+
+    # The options of the count and run commands.
+    counting = argparse.ArgumentParser(add_help=False)
+    counting.add_argument('--table', metavar='DIR', default=None,
+                          help='count the occurrences with a token table '
+                               'that is stored in this directory (delete the '
+                               'directory to rebuild it)')
+    counting.add_argument('--index', metavar='DIR', default=None,
+                          help='like --table, but with an inverted index')
+    counting.add_argument('--store', metavar='DIR', default=None,
+                          help='read the files from a memory-mapped corpus '
+                               'store in this directory (delete the '
+                               'directory to rebuild it)')
+    counting.add_argument('--incremental', metavar='FILE', nargs='?',
+                          default=None, const=INCREMENTAL_PATH,
+                          help='only recompute the counts for new/changed '
+                               'files and matchers, and store the counts in '
+                               'this file (default: {})'
+                               .format(INCREMENTAL_PATH))
+    counting.add_argument('--cube', metavar='FILE', default=None,
+                          help='save the counts per matcher, child and '
+                               'session to this file (.npz, .csv or '
+                               '.parquet)')
+    counting.add_argument('--acquisition', metavar='FILE', default=None,
+                          help='save the acquisition age and order of each '
+                               'matcher for each child to this CSV file')
+
+    # The options of the plot and run commands.
+    plotting = argparse.ArgumentParser(add_help=False)
+    plotting.add_argument('--plot-corpora', dest='corpora',
+                          action='store_true',
+                          help='also plot the results of each corpus (i.e. '
+                               'each directory in the data directory)')
+    plotting.add_argument('--bands', metavar='N', type=int, nargs='?',
+                          const=True, default=None,
+                          help='draw bootstrap confidence bands (95%%) '
+                               'around the curves, from N resamples of the '
+                               'sessions (default: 1000)')
+    plotting.add_argument('--output-dir', metavar='DIR', default=OUTPUT_DIR,
+                          help='save the plots in this directory '
+                               '(default: %(default)s)')
+
+    parser = argparse.ArgumentParser(
+        description='Counts functional morphemes in CHILDES transcripts. '
+                    'Without a command, "run" is assumed.')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.add_parser('run', parents=[common, reading, counting, plotting],
+                        help='count the occurrences and plot the results')
+    count_parser = commands.add_parser(
+        'count', parents=[common, reading, counting],
+        help='count the occurrences and save the counts per file as JSON '
+             '(see shards.py)')
+    count_parser.add_argument('--output', metavar='FILE',
+                              default=RESULTS_PATH,
+                              help='save the results to this file '
+                                   '(default: %(default)s)')
+    count_parser.add_argument('--shard', metavar='I/N', type=parse_shard,
+                              default=None,
+                              help='only count the files of the I-th of N '
+                                   'shards (0 <= I < N)')
+    merge_parser = commands.add_parser(
+        'merge', parents=[common],
+        help='merge the result files of several shards')
+    merge_parser.add_argument('files', metavar='FILE', nargs='+',
+                              help='the result files of the shards')
+    merge_parser.add_argument('--output', metavar='FILE',
+                              default=RESULTS_PATH,
+                              help='save the merged results to this file '
+                                   '(default: %(default)s)')
+    merge_parser.add_argument('--partial', action='store_true',
+                              help='merge even if some shards are missing')
+    plot_parser = commands.add_parser(
+        'plot', parents=[common, plotting],
+        help='plot the results saved by the count or merge command')
+    plot_source = plot_parser.add_mutually_exclusive_group()
+    plot_source.add_argument('--results', metavar='FILE',
+                             default=RESULTS_PATH,
+                             help='the saved results (default: %(default)s)')
+    plot_source.add_argument('--cube', metavar='FILE', default=None,
+                             help='plot the results in this cube (.npz) '
+                                  'instead')
+    extract_parser = commands.add_parser(
+        'extract', parents=[common, reading],
+        help='parse the files into the cache, a corpus store and/or a token '
+             'table')
+    extract_parser.add_argument('--store', metavar='DIR', default=None,
+                                help='create a corpus store in this '
+                                     'directory')
+    extract_parser.add_argument('--table', metavar='DIR', default=None,
+                                help='create a token table in this directory')
+    index_parser = commands.add_parser(
+        'index', parents=[common, reading],
+        help='create an inverted index of the files (see index.py)')
+    index_parser.add_argument('path', metavar='DIR',
+                              help='save the index in this directory')
+    query_parser = commands.add_parser(
+        'query', parents=[common],
+        help='print the (file, utterance, token, speaker) locations of a '
+             'matcher in an index')
+    query_parser.add_argument('path', metavar='DIR', help='the index')
+    query_parser.add_argument('constraints', metavar='FIELD=VALUE',
+                              nargs='*',
+                              help='the arguments of the matcher (see '
+                                   'match.Matcher), e.g. infl_fusion=PAST; '
+                                   'several values are separated by commas')
+    query_parser.add_argument('--label', default=None,
+                              help='query the matcher with this label '
+                                   'instead (see --matchers)')
+    query_parser.add_argument('--speaker', metavar='CODE', nargs='+',
+                              default=None,
+                              help='only print the occurrences of these '
+                                   'speakers')
+    query_parser.add_argument('--limit', metavar='N', type=int, default=None,
+                              help='print at most N locations')
+    serve_parser = commands.add_parser(
+        'serve', parents=[common, reading],
+        help='keep the corpus in memory and answer count and concordance '
+             'queries over HTTP (see server.py)')
+    serve_parser.add_argument('--index', metavar='DIR', default=None,
+                              help='load the index from this directory, or '
+                                   'create it there if it does not exist')
+    serve_parser.add_argument('--host', default='127.0.0.1',
+                              help='the address to listen on '
+                                   '(default: %(default)s)')
+    serve_parser.add_argument('--port', type=int, default=8040,
+                              help='the port to listen on '
+                                   '(default: %(default)s)')
+    serve_parser.add_argument('--cache-size', metavar='N', type=int,
+                              default=1024,
+                              help='the number of results kept in the LRU '
+                                   'cache (default: %(default)s)')
+    return parser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    # Without a command, the whole analysis is run (as in earlier versions).
+    if not argv or (argv[0] not in COMMANDS
+                    and argv[0] not in ('-h', '--help')):
+        argv = ['run'] + argv
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'extract' and not (args.cache or args.store
+                                          or args.table):
+        parser.error('extract requires --cache, --store or --table')
+    if args.command == 'query' and not (args.constraints or args.label):
+        parser.error('query requires FIELD=VALUE constraints or --label')
+    configure(args.data, args.child, args.parents, args.max_age)
+    if args.profile:
+        profiler.enabled = True
+        profiler.reset()
+    make_output_dirs(args)
+    listener = logsink.start(args.log, args.log_level, args.log_sample)
+    try:
+        COMMANDS[args.command](args)
+    finally:
+        logsink.stop(listener)
+    if args.profile:
+        profiler.write_json(args.profile)
+        sys.stderr.write(profiler.summary() + '\n')
+
+
+if __name__ == '__main__':
+    main()
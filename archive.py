@@ -0,0 +1,144 @@
+# Reading CHILDES transcripts directly from zip and tar archives, without
+# extracting them.
+#
+# A transcript in an archive is identified by a path in which the archive is
+# treated like a directory, e.g. data/Brown.zip/Brown/Adam/020304.xml. These
+# paths are plain strings, so they can be passed to worker processes like the
+# paths of extracted files. Each process opens an archive only once and then
+# reads the members from the open archive. The members of a zip archive are
+# listed from its central directory, so no member is decompressed until it is
+# read. In compressed tar archives (.tar.gz, ...), reading a member can
+# require decompressing the archive up to that member, so zip archives or
+# uncompressed tar archives are much faster.
+
+import os
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+                    '.tar.xz', '.txz')
+
+# The archives opened by this process:
+# {archive path -> (pid, (size, mtime), ZipFile/TarFile, {member -> info})}
+# The pid is stored because an archive opened before a fork must not be used
+# by the child processes: they would share the position in the file.
+_archives = {}
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+# The name without the archive suffix (e.g. Brown for Brown.zip).
+def strip_suffix(name):
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+# Returns (archive path, member name) for a path inside an archive, and
+# (path, None) for any other path.
+def split_path(path):
+    parts = path.replace('\\', '/').split('/')
+    for i, part in enumerate(parts[:-1]):
+        if is_archive(part):
+            archive = '/'.join(parts[:i + 1])
+            if os.path.isfile(archive):
+                return archive, '/'.join(parts[i + 1:])
+    return path, None
+
+
+def is_member(path):
+    return split_path(path)[1] is not None
+
+
+# Returns the open archive and its {member name -> info} dictionary. The
+# archive is opened again if it changed on disk.
+def _open_archive(path):
+    stat = os.stat(path)
+    try:
+        pid, archive_stat, archive, members = _archives[path]
+        if pid == os.getpid() \
+           and archive_stat == (stat.st_size, stat.st_mtime):
+            return archive, members
+    except KeyError:
+        pass
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        members = {info.filename: info for info in archive.infolist()
+                   if not info.is_dir()}
+    else:
+        archive = tarfile.open(path)
+        # Archives created with 'tar -C dir .' prefix the names with './'.
+        members = {info.name[2:] if info.name.startswith('./')
+                   else info.name: info
+                   for info in archive.getmembers() if info.isfile()}
+    _archives[path] = (os.getpid(), (stat.st_size, stat.st_mtime), archive,
+                       members)
+    return archive, members
+
+
+def _member_info(path):
+    archive_path, member = split_path(path)
+    archive, members = _open_archive(archive_path)
+    try:
+        return archive, members[member]
+    except KeyError:
+        raise FileNotFoundError('No such member in {}: {}'
+                                .format(archive_path, member))
+
+
+# The names of the members of the archive that end with the suffix, sorted.
+def members(path, suffix='.xml'):
+    return sorted(name for name in _open_archive(path)[1]
+                  if name.endswith(suffix))
+
+
+# The paths (relative to the directory) of the members of all archives
+# directly in the directory that end with the suffix.
+def archive_files(directory, suffix='.xml'):
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if is_archive(name) and os.path.isfile(path):
+            files.extend('{}/{}'.format(name, member)
+                         for member in members(path, suffix))
+    return files
+
+
+# Opens a file or an archive member for reading (in binary mode).
+def open_file(path):
+    if not is_member(path):
+        return open(path, 'rb')
+    archive, info = _member_info(path)
+    if isinstance(archive, zipfile.ZipFile):
+        return archive.open(info)
+    return archive.extractfile(info)
+
+
+# Yields what an XML parser should read: the path itself for a file (which
+# the parsers open faster themselves), or an open file object for an archive
+# member.
+@contextmanager
+def xml_source(path):
+    if not is_member(path):
+        yield path
+        return
+    with open_file(path) as f:
+        yield f
+
+
+# Returns (size, mtime) of a file or an archive member. For zip members,
+# the modification time is stored with a resolution of two seconds.
+def file_stat(path):
+    if not is_member(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+    _, info = _member_info(path)
+    if isinstance(info, zipfile.ZipInfo):
+        return info.file_size, time.mktime(info.date_time + (0, 0, -1))
+    return info.size, info.mtime
@@ -0,0 +1,276 @@
+# Benchmarks for parsing, matching, aggregation and plotting on a synthetic
+# corpus (see synthetic.py).
+#
+# Each benchmark is timed (best of --repeat runs) and then run once more in a
+# forked process to record its peak memory: the increase of the maximum
+# resident set size, which (unlike tracemalloc) includes the memory allocated
+# by C libraries such as libxml2. The results can be saved as JSON and
+# compared against a previous run: with --baseline, the script fails if the
+# throughput of any benchmark drops by more than --tolerance.
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+# Imports from this repository:
+import analyze
+from corpusreader import BACKENDS, CHILDESMorphFileReader
+from index import CorpusIndex
+from match import SentenceMatcher, load_matchers
+from queryplan import QueryPlan
+from synthetic import add_corpus_arguments, generate_corpus
+from tokentable import TokenTable
+from visualize import visualize
+
+
+# The only real CHILDES transcript in the repository, which is also used to
+# check the parser backends (see parser_mismatches).
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                         'test.xml')
+
+
+def max_rss():
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+# Runs the function in a forked process (which starts with the resident set
+# of the parent) and returns by how much its maximum resident set size grew.
+def peak_memory(func):
+    def run(conn):
+        start = max_rss()
+        func()
+        conn.send(max_rss() - start)
+        conn.close()
+
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run, args=(sender,))
+    process.start()
+    sender.close()
+    try:
+        peak = receiver.recv()
+    except EOFError:
+        raise RuntimeError('The benchmark failed in the child process.')
+    finally:
+        process.join()
+    return peak
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, peak_memory(func)
+
+
+def run_benchmarks(data_path, files, repeat, tmp_dir):
+    analyze.DATA_PATH = data_path
+    matchers = load_matchers(analyze.MATCHERS_PATH)
+    reader = CHILDESMorphFileReader(data_path, files)
+    sents = list(reader.iter_morph_sents())
+    n_tokens = sum(len(sent) for sent in sents)
+    token_matchers = [matcher for matcher in matchers
+                      if not isinstance(matcher, SentenceMatcher)]
+    sentence_matchers = [matcher for matcher in matchers
+                         if isinstance(matcher, SentenceMatcher)]
+    cache_dir = os.path.join(tmp_dir, 'cache')
+    table_dir = os.path.join(tmp_dir, 'table')
+    index_dir = os.path.join(tmp_dir, 'index')
+    TokenTable.from_corpus(reader).save(table_dir)
+    CorpusIndex.from_corpus(reader).save(index_dir)
+    results = analyze.analyze_files(files, matchers, verbose=False)
+
+    def parse_tree():
+        for fileid in files:
+            for _ in reader.tagged_morph_sents(fileid):
+                pass
+
+    def parse_stream():
+        for _ in reader.iter_morph_sents():
+            pass
+
+    def parse_stream_with(parser):
+        def parse():
+            backend_reader = CHILDESMorphFileReader(data_path, files,
+                                                    parser=parser)
+            for _ in backend_reader.iter_morph_sents():
+                pass
+        return parse
+
+    def load_cache():
+        cached = CHILDESMorphFileReader(data_path, files, cache_dir=cache_dir)
+        for fileid in files:
+            for _ in cached.iter_morph_sents(fileid):
+                pass
+
+    def match_tokens():
+        for matcher in token_matchers:
+            for sent in sents:
+                for word in sent:
+                    matcher.match(word)
+
+    def match_sentences():
+        for matcher in sentence_matchers:
+            for sent in sents:
+                matcher.match(sent)
+
+    def match_plan():
+        plan = QueryPlan(matchers)
+        for sent in sents:
+            plan.count(sent)
+
+    def count_files():
+        analyze.analyze_files(files, matchers, verbose=False)
+
+    def count_cached_files():
+        analyze.analyze_files(files, matchers, verbose=False,
+                              cache_dir=cache_dir)
+
+    def count_table():
+        TokenTable.load(table_dir).count_occurrences(
+            matchers, {}, analyze.CHILD, analyze.PARENTS,
+            analyze.MAX_AGE)
+
+    def count_index():
+        CorpusIndex.load(index_dir).count_occurrences(
+            matchers, {}, analyze.CHILD, analyze.PARENTS,
+            analyze.MAX_AGE)
+
+    def plot():
+        visualize(results, compare_adult=False, display=False,
+                  filename=os.path.join(tmp_dir, 'plot'), verbose=False)
+
+    load_cache()  # Fill the cache.
+    benchmarks = [('parsing (whole tree)', parse_tree),
+                  ('parsing (streaming)', parse_stream)]
+    benchmarks += [('parsing (streaming, {})'.format(parser),
+                    parse_stream_with(parser)) for parser in BACKENDS]
+    benchmarks += [('parsing (cached)', load_cache),
+                   ('matching (tokens)', match_tokens),
+                   ('matching (sentences)', match_sentences),
+                   ('matching (query plan)', match_plan),
+                   ('aggregation (files)', count_files),
+                   ('aggregation (cached files)', count_cached_files),
+                   ('aggregation (token table)', count_table),
+                   ('aggregation (index)', count_index),
+                   ('plotting', plot)]
+    report = {'files': len(files), 'utterances': len(sents),
+              'tokens': n_tokens, 'benchmarks': {}}
+    for name, func in benchmarks:
+        # Suppress the messages about skipped files/empty months.
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            seconds, peak = measure(func, repeat)
+        report['benchmarks'][name] = {
+            'seconds': seconds,
+            'tokens_per_second': n_tokens / seconds,
+            'peak_memory_bytes': peak}
+        print('{:>28}: {:8.3f} s {:>12.0f} tokens/s {:>9.1f} MiB peak'
+              .format(name, seconds, n_tokens / seconds, peak / 2 ** 20))
+    return report
+
+
+# Returns the names of the XML parser backends whose Words differ from those
+# of the standard library's parser (for the whole tree as well as for the
+# streaming reader).
+def parser_mismatches(data_path, files):
+    def words(parser):
+        reader = CHILDESMorphFileReader(data_path, files, parser=parser)
+        return ([[str(word) for word in sent]
+                 for sent in reader.tagged_morph_sents()],
+                [(who, [str(word) for word in sent]) for who, sent
+                 in reader.iter_morph_sents(keep_speaker=True)])
+
+    expected = words('etree')
+    return [parser for parser in BACKENDS if words(parser) != expected]
+
+
+# Returns the benchmarks whose throughput dropped by more than the tolerance.
+def regressions(report, baseline, tolerance):
+    slower = []
+    for name, entry in report['benchmarks'].items():
+        try:
+            before = baseline['benchmarks'][name]['tokens_per_second']
+        except KeyError:
+            continue
+        if entry['tokens_per_second'] < before * (1 - tolerance):
+            slower.append((name, before, entry['tokens_per_second']))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--children', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--utterances', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    add_corpus_arguments(parser)
+    parser.add_argument('--output', metavar='FILE',
+                        help='save the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare against the results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='maximum allowed relative drop in throughput '
+                             '(default: 0.2)')
+    parser.add_argument('--check-parsers', action='store_true',
+                        help='check that all XML parser backends produce '
+                             'the same Words (and fail otherwise)')
+    args = parser.parse_args()
+    if args.mix:
+        args.mix = dict(args.mix)
+
+    tmp_dir = tempfile.mkdtemp(prefix='childes-benchmark-')
+    try:
+        data_path = os.path.join(tmp_dir, 'data')
+        files = generate_corpus(data_path, args.children, args.sessions,
+                                args.utterances, args.speakers, args.mix,
+                                args.seed)
+        if args.check_parsers:
+            mismatches = set(parser_mismatches(data_path, files))
+            mismatches.update(parser_mismatches(
+                os.path.dirname(TEST_FILE), [os.path.basename(TEST_FILE)]))
+            mismatches = [parser for parser in BACKENDS
+                          if parser in mismatches]
+            print('Parser backends: {} ({})'.format(
+                ', '.join(BACKENDS),
+                'mismatch: ' + ', '.join(mismatches) if mismatches
+                else 'identical Words'))
+            if mismatches:
+                sys.exit(1)
+        report = run_benchmarks(data_path, files, args.repeat, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+    report['settings'] = vars(args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as f:
+            baseline = json.load(f)
+        slower = regressions(report, baseline, args.tolerance)
+        for name, before, after in slower:
+            print('Regression: {} ({:.0f} -> {:.0f} tokens/s)'
+                  .format(name, before, after))
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Bootstrap confidence bands for the curves of visualize.visualize.
+#
+# The value of a curve at an age is the ratio of the summed counts of all
+# sessions (of all children) at that age. To estimate its uncertainty, the
+# sessions of each age are resampled with replacement and the ratio is
+# computed for each resample. All resamples of an age are drawn at once, as a
+# matrix with the number of times each session is drawn per resample, so that
+# the summed counts of all resamples and matchers are a single matrix
+# product. The ages are processed in parallel.
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+RESAMPLES = 1000
+CONFIDENCE = 0.95
+# The maximum number of (resample, session) weights held in memory at once.
+CHUNK_SIZE = 2 ** 22
+
+
+# Returns the lower and upper bounds of the confidence interval of each
+# matcher, given the [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par] counts
+# (session, matcher, 4) of the sessions at one age. seed is passed to
+# np.random.default_rng.
+def bootstrap_ratios(counts, compare_adult=False, resamples=RESAMPLES,
+                     confidence=CONFIDENCE, seed=0):
+    rng = np.random.default_rng(seed)
+    n, n_matchers, _ = counts.shape
+    counts = counts.reshape(n, n_matchers * 4).astype(float)
+    sums = []
+    step = max(1, CHUNK_SIZE // n)
+    for start in range(0, resamples, step):
+        size = min(step, resamples - start)
+        # How often each session is drawn in each resample.
+        drawn = rng.integers(0, n, size=(size, n))
+        drawn += np.arange(size)[:, None] * n
+        weights = np.bincount(drawn.ravel(), minlength=size * n)
+        sums.append(weights.reshape(size, n) @ counts)
+    sums = np.concatenate(sums).reshape(resamples, n_matchers, 4)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = sums[..., 0] / sums[..., 1]
+        if compare_adult:
+            ratios = ratios / (sums[..., 2] / sums[..., 3])
+    ratios[~np.isfinite(ratios)] = np.nan
+    alpha = (1 - confidence) / 2
+    low = np.full(n_matchers, np.nan)
+    high = np.full(n_matchers, np.nan)
+    ok = ~np.isnan(ratios).all(axis=0)
+    if ok.any():
+        low[ok], high[ok] = np.nanquantile(ratios[:, ok], [alpha, 1 - alpha],
+                                           axis=0)
+    return low, high
+
+
+def _bootstrap_age(args):
+    return bootstrap_ratios(*args)
+
+
+# Returns {matcher label -> (ages, low, high)} for the results cube (see
+# cube.py), using the same sessions as ResultsCube.to_results (i.e. the
+# sessions with child utterances; the number of child utterances is the same
+# for all matchers). The resamples are shared by all matchers.
+def confidence_bands(cube, compare_adult=False, resamples=RESAMPLES,
+                     confidence=CONFIDENCE, jobs=1, seed=0):
+    c, s = np.nonzero(cube.order >= 0)
+    # (session, matcher, 4)
+    counts = cube.data[:, c, s].reshape(len(cube.matchers), len(c),
+                                        4).transpose(1, 0, 2)
+    valid = counts[:, :, 1].max(axis=1, initial=0) > 0
+    session_ages = cube.ages[c, s][valid].astype(np.int64)
+    counts = counts[valid]
+    ages = np.unique(session_ages)
+    tasks = [(counts[session_ages == age], compare_adult, resamples,
+              confidence, [seed, int(age)]) for age in ages.tolist()]
+    if jobs == 1:
+        bounds = list(map(_bootstrap_age, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            bounds = list(executor.map(_bootstrap_age, tasks))
+    low = np.array([b[0] for b in bounds]).reshape(len(ages),
+                                                   len(cube.matchers))
+    high = np.array([b[1] for b in bounds]).reshape(len(ages),
+                                                    len(cube.matchers))
+    return {label: (ages, low[:, m], high[:, m])
+            for m, label in enumerate(cube.matchers)}
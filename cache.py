@@ -0,0 +1,125 @@
+# An on-disk cache for the parsed CHILDES transcripts, so that the XML files
+# only need to be parsed again when they (or the reader) change.
+#
+# Each transcript is stored in a separate file in a columnar format: all
+# strings (word forms, tags, speakers, ...) are interned in a single string
+# table, and each Word attribute is stored as an array of indices into that
+# table. An entry is valid if it was created by the same parser version with
+# the same settings and the content hash of the transcript matches. If the
+# size and modification time of the transcript are unchanged, the hash is not
+# recomputed. Transcripts in archives (see archive.py) are cached like files,
+# with the size and modification time of the archive member.
+
+import array
+import hashlib
+import os
+import pickle
+# Imports from this repository:
+from archive import file_stat, open_file
+from word import Word
+
+
+# Increase this whenever the output of CHILDESMorphFileReader changes.
+PARSER_VERSION = 1
+CACHE_DIR = 'cache'
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open_file(path) as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cache_path(cache_dir, fileid):
+    key = hashlib.sha1(os.path.abspath(fileid).encode('utf8')).hexdigest()
+    return os.path.join(cache_dir, key + '.cache')
+
+
+def _header(fileid, strip_space, sha1=None):
+    size, mtime = file_stat(fileid)
+    return {'version': PARSER_VERSION,
+            'path': os.path.abspath(fileid),
+            'size': size,
+            'mtime': mtime,
+            'strip_space': strip_space,
+            'sha1': sha1}
+
+
+# Returns (participants, utterances), where participants is a list of
+# (id, age) tuples and utterances is a list of (speaker, sentence) tuples,
+# or None if there is no valid cache entry for the given file.
+def load(cache_dir, fileid, strip_space=True):
+    path = cache_path(cache_dir, fileid)
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    cached = entry['header']
+    current = _header(fileid, strip_space)
+    for key in ('version', 'path', 'strip_space'):
+        if cached[key] != current[key]:
+            return None
+    if cached['size'] != current['size'] \
+       or cached['mtime'] != current['mtime']:
+        # The file was touched, but its content might still be the same.
+        current['sha1'] = file_hash(fileid)
+        if cached['sha1'] != current['sha1']:
+            return None
+        entry['header'] = current
+        _write(path, entry)
+    return entry['participants'], decode(entry)
+
+
+def store(cache_dir, fileid, participants, utterances, strip_space=True):
+    entry = encode(utterances)
+    entry['header'] = _header(fileid, strip_space, file_hash(fileid))
+    entry['participants'] = participants
+    os.makedirs(cache_dir, exist_ok=True)
+    _write(cache_path(cache_dir, fileid), entry)
+
+
+def _write(path, entry):
+    # Write to a temporary file first so that concurrent readers never see
+    # a partially written entry.
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def encode(utterances):
+    strings = []
+    string_ids = {}
+
+    def intern(string):
+        try:
+            return string_ids[string]
+        except KeyError:
+            string_ids[string] = len(strings)
+            strings.append(string)
+            return string_ids[string]
+
+    columns = {attr: array.array('I') for attr in Word.__slots__}
+    offsets = array.array('I', [0])
+    speakers = array.array('I')
+    for speaker, sent in utterances:
+        speakers.append(intern(speaker))
+        for word in sent:
+            for attr in Word.__slots__:
+                columns[attr].append(intern(getattr(word, attr)))
+        offsets.append(offsets[-1] + len(sent))
+    return {'strings': strings, 'columns': columns,
+            'offsets': offsets, 'speakers': speakers}
+
+
+def decode(entry):
+    strings = entry['strings']
+    columns = [[strings[i] for i in entry['columns'][attr]]
+               for attr in Word.__slots__]
+    words = [Word.from_fields(*fields) for fields in zip(*columns)]
+    offsets = entry['offsets']
+    return [(strings[speaker], words[offsets[i]:offsets[i + 1]])
+            for i, speaker in enumerate(entry['speakers'])]
@@ -23,18 +23,226 @@
 # For license information, see LICENSE.TXT
 
 
+import os
+import time
 from nltk.corpus.reader import CHILDESCorpusReader
 from nltk.corpus.reader.xmldocs import ElementTree
+from nltk.data import FileSystemPathPointer
 from nltk.util import LazyMap, LazyConcatenation
-from word import Word  # Import from this repository.
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+# Imports from this repository:
+import archive
+import cache
+from manifest import scan_participants
+from profiling import profiler
+from word import Word
 
 # From nltk.corpus.reader.childes:
 # to resolve the namespace issue
 NS = 'http://www.talkbank.org/ns/talkbank'
+U_TAG = '{%s}u' % NS  # VB: Added.
+PARTICIPANT_TAG = '{%s}participant' % NS  # VB: Added.
+
+
+# VB: Added. The XML parser backends. Both return trees with the same
+# ElementTree API, and the lxml parser is configured to drop comments and
+# processing instructions like the standard library's parser does, so that
+# both backends produce exactly the same Words.
+class EtreeBackend:
+
+    name = 'etree'
+
+    @staticmethod
+    def parse(fileid):
+        return ElementTree.parse(fileid).getroot()
+
+    # Yields the elements with the given tags as soon as their closing tag
+    # has been parsed. Once the caller is done with an element, it is
+    # cleared, and the children of the root element parsed so far are
+    # discarded, so that the whole file is never kept in memory.
+    @staticmethod
+    def iter_elements(fileid, tags):
+        root = None
+        depth = 0
+        for event, elem in ElementTree.iterparse(fileid,
+                                                 events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if elem.tag not in tags:
+                continue
+            yield elem
+            elem.clear()
+            if depth == 1:  # Element is a child of the root element.
+                del root[:]
+
+
+class LxmlBackend:
+
+    name = 'lxml'
+
+    @staticmethod
+    def parse(fileid):
+        parser = lxml_etree.XMLParser(remove_comments=True, remove_pis=True)
+        return lxml_etree.parse(fileid, parser).getroot()
+
+    # See EtreeBackend.iter_elements. Here, the other elements are filtered
+    # out by the parser.
+    @staticmethod
+    def iter_elements(fileid, tags):
+        for _, elem in lxml_etree.iterparse(fileid, tag=tags,
+                                            remove_comments=True,
+                                            remove_pis=True):
+            yield elem
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None and parent.getparent() is None:
+                # Element is a child of the root element.
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+
+BACKENDS = {'etree': EtreeBackend}
+if lxml_etree is not None:
+    BACKENDS['lxml'] = LxmlBackend
+# The environment variable for choosing the backend (see get_backend).
+PARSER_ENV = 'CHILDES_XML_PARSER'
+
+
+# VB: Added. Returns the backend with the given name ('etree', 'lxml' or
+# 'auto'). If no name is given, it is read from the environment variable
+# CHILDES_XML_PARSER. 'auto' (the default) uses lxml if it is installed, and
+# the standard library otherwise.
+def get_backend(name=None):
+    if name is None:
+        name = os.environ.get(PARSER_ENV, 'auto')
+    if name == 'auto':
+        return BACKENDS.get('lxml', EtreeBackend)
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown or unavailable XML parser: {} '
+                         '(available: {})'.format(name, ', '.join(BACKENDS)))
+
+
+# VB: Added. The (namespace-qualified) tags used by scan_word.
+W_PATH = './/{%s}w' % NS
+MOR_TAG = '{%s}mor' % NS
+MOR_POST_TAG = '{%s}mor-post' % NS
+MW_TAG = '{%s}mw' % NS
+POS_TAG = '{%s}pos' % NS
+C_TAG = '{%s}c' % NS
+S_TAG = '{%s}s' % NS
+STEM_TAG = '{%s}stem' % NS
+MK_TAG = '{%s}mk' % NS
+GRA_TAG = '{%s}gra' % NS
+REPLACEMENT_TAG = '{%s}replacement' % NS
+
+# VB: Added. The position of an element relative to the closest <mor>
+# element above it: in mor, mor/mw, mor/mor-post, mor/mor-post/mw or
+# mor/mor-post/mw/pos (or none of these).
+OTHER, IN_MOR, IN_MW, IN_POST, IN_POST_MW, IN_POST_POS = range(6)
+
+
+# VB: Added. Walks the word element once (in document order) and returns the
+# elements that NLTK's _get_words method searches for separately:
+# (.//stem, .//mor/mw/mk, .//mor/mor-post/mw/stem, .//c, .//s,
+#  .//mor/mor-post/mw/pos/c, .//mor/mor-post/mw/pos/s, the last .//mor/gra,
+#  the last .//mor/mor-post/gra, .//replacement).
+# Each of them is None if the word does not contain it.
+def scan_word(xmlword):
+    stem = infl = suffix_stem = pos = pos2 = suffix_pos = suffix_pos2 = None
+    rel = post_rel = replacement = None
+    stack = [(xmlword, OTHER)]
+    while stack:
+        elem, state = stack.pop()
+        tag = elem.tag
+        if tag == STEM_TAG:
+            if stem is None:
+                stem = elem
+            if state == IN_POST_MW and suffix_stem is None:
+                suffix_stem = elem
+        elif tag == C_TAG:
+            if pos is None:
+                pos = elem
+            if state == IN_POST_POS and suffix_pos is None:
+                suffix_pos = elem
+        elif tag == S_TAG:
+            if pos2 is None:
+                pos2 = elem
+            if state == IN_POST_POS and suffix_pos2 is None:
+                suffix_pos2 = elem
+        elif tag == MK_TAG:
+            if state == IN_MW and infl is None:
+                infl = elem
+        elif tag == GRA_TAG:
+            if state == IN_MOR:
+                rel = elem
+            elif state == IN_POST:
+                post_rel = elem
+        elif tag == REPLACEMENT_TAG:
+            if replacement is None:
+                replacement = elem
+        if not len(elem):
+            continue
+        # The state of the children of this element.
+        if tag == MOR_TAG:
+            state = IN_MOR
+        elif tag == MW_TAG:
+            state = IN_MW if state == IN_MOR else \
+                IN_POST_MW if state == IN_POST else OTHER
+        elif tag == MOR_POST_TAG:
+            state = IN_POST if state == IN_MOR else OTHER
+        elif tag == POS_TAG:
+            state = IN_POST_POS if state == IN_POST_MW else OTHER
+        else:
+            state = OTHER
+        # Push the children in reverse, so that they are visited in order.
+        for i in range(len(elem) - 1, -1, -1):
+            stack.append((elem[i], state))
+    return (stem, infl, suffix_stem, pos, pos2, suffix_pos, suffix_pos2, rel,
+            post_rel, replacement)
+
+
+# VB: Added. A root directory whose file ids can also point into archives
+# in the directory (see archive.py). NLTK's path pointers only accept
+# existing files, so the paths of archive members are returned as strings.
+class ArchivePathPointer(FileSystemPathPointer):
+
+    def join(self, fileid):
+        path = os.path.join(self._path, fileid)
+        if archive.is_member(path):
+            return path
+        return FileSystemPathPointer(path)
 
 
 class CHILDESMorphFileReader(CHILDESCorpusReader):
 
+    # VB: Added. If cache_dir is given, the parsed files are stored in (and
+    # loaded from) the cache in that directory. See cache.py. The parser
+    # selects the XML parser backend (see get_backend). The file ids can
+    # point into zip and tar archives in the root directory, like
+    # 'Brown.zip/Brown/Adam/020304.xml' (see archive.py).
+    def __init__(self, root, fileids, lazy=True, cache_dir=None,
+                 parser=None):
+        if isinstance(root, str) and os.path.isdir(root):
+            # NLTK would search the directory for a file id given as a
+            # regular expression, which does not find archive members.
+            if isinstance(fileids, str) \
+               and archive.is_member(os.path.join(root, fileids)):
+                fileids = [fileids]
+            root = ArchivePathPointer(root)
+        CHILDESCorpusReader.__init__(self, root, fileids, lazy)
+        self._backend = get_backend(parser)
+        self._cache_dir = cache_dir
+        self._cached = None  # The most recently loaded cache entry.
+
     # NLTK's tagged_sents method.
     def tagged_morph_sents(  # VB: Changed method name.
             self,
@@ -71,133 +279,236 @@ class CHILDESMorphFileReader(CHILDESCorpusReader):
             )
             return LazyConcatenation(LazyMap(get_words, self.abspaths(fileids)))
 
+    # VB: Added.
+    def speaker_morph_sents(self, fileids=None, speaker='ALL',
+                            strip_space=True):
+        """
+        :return: the given file(s) as a list of ``(speaker, sentence)``
+            tuples, where each sentence is a list of ``Word`` objects. This
+            allows distinguishing between several speakers while traversing
+            each file only once.
+        :param speaker: see ``tagged_morph_sents``
+        :param strip_space: see ``tagged_morph_sents``
+        :rtype: list(tuple(str, list(Word)))
+        """
+        if not self._lazy:
+            return [
+                self._get_morph_words(fileid, speaker, strip_space,
+                                      keep_speaker=True)
+                for fileid in self.abspaths(fileids)
+            ]
+
+        get_words = lambda fileid: self._get_morph_words(
+            fileid, speaker, strip_space, keep_speaker=True
+        )
+        return LazyConcatenation(LazyMap(get_words, self.abspaths(fileids)))
+
+
+    # VB: Added.
+    def iter_morph_sents(self, fileids=None, speaker='ALL', strip_space=True,
+                         keep_speaker=False):
+        """
+        :return: an iterator over the sentences of the given file(s). The
+            files are parsed incrementally, so that only the current
+            utterance needs to be kept in memory.
+        :param speaker: see ``tagged_morph_sents``
+        :param strip_space: see ``tagged_morph_sents``
+        :param keep_speaker: If true, yield ``(speaker, sentence)`` tuples
+            like ``speaker_morph_sents``. Otherwise, only yield sentences.
+        :rtype: iter(list(Word))
+        """
+        for fileid in self.abspaths(fileids):
+            if self._cache_dir is None:
+                for sent in self._iter_morph_words(fileid, speaker,
+                                                   strip_space, keep_speaker):
+                    yield sent
+                continue
+            if isinstance(speaker, str) and speaker != 'ALL':
+                speaker = [speaker]
+            _, utterances = self._cached_morph_words(fileid, strip_space)
+            for who, sent in utterances:
+                if speaker == 'ALL' or who in speaker:
+                    if keep_speaker:
+                        yield who, sent
+                    else:
+                        yield sent
+
+    # VB: Added. Returns the participants and the utterances of all speakers
+    # in the given file, either from the cache or by parsing the file (and
+    # then adding it to the cache).
+    def _cached_morph_words(self, fileid, strip_space):
+        key = (fileid, strip_space)
+        if self._cached is not None and self._cached[0] == key:
+            return self._cached[1]
+        entry = cache.load(self._cache_dir, fileid, strip_space)
+        profiler.count('cache hits' if entry else 'cache misses')
+        if entry is None:
+            participants = []
+            utterances = list(self._iter_morph_words(fileid, 'ALL',
+                                                     strip_space,
+                                                     keep_speaker=True,
+                                                     participants=participants))
+            cache.store(self._cache_dir, fileid, participants, utterances,
+                        strip_space)
+            entry = (participants, utterances)
+        self._cached = (key, entry)
+        return entry
+
+    # NLTK's _get_age method.
+    # VB: Added the cache lookup and the header scan for archive members.
+    def _get_age(self, fileid, speaker, month):
+        if self._cache_dir is not None:
+            participants, _ = self._cached_morph_words(fileid, True)
+        elif archive.is_member(fileid):
+            participants = scan_participants(fileid)
+        else:
+            return CHILDESCorpusReader._get_age(self, fileid, speaker, month)
+        for pat_id, age in participants:
+            try:
+                if pat_id == speaker:
+                    if month:
+                        age = self.convert_age(age)
+                    return age
+            # some files don't have age data
+            except (TypeError, AttributeError, ValueError) as e:
+                return None
 
     # NLTK's _get_words method.
     def _get_morph_words(
-            self, fileid, speaker, strip_space  # VB: Removed stem/sent/pos/relation/replace keywords.
+            self, fileid, speaker, strip_space,  # VB: Removed stem/sent/pos/relation/replace keywords.
+            keep_speaker=False  # VB: Added.
         ):
             if (
                 isinstance(speaker, str) and speaker != 'ALL'  # VB: Changed six.string_types to str.
             ):  # ensure we have a list of speakers
                 speaker = [speaker]
-            xmldoc = ElementTree.parse(fileid).getroot()
+            with archive.xml_source(fileid) as source:  # VB: Added for archive members.
+                xmldoc = self._backend.parse(source)  # VB: Was ElementTree.parse(fileid).getroot().
             # processing each xml doc
             results = []
             for xmlsent in xmldoc.findall('.//{%s}u' % NS):
-                sents = []
-                skip = False  # VB: Skip replacements.
                 # select speakers
                 if speaker == 'ALL' or xmlsent.get('who') in speaker:
-                    for xmlword in xmlsent.findall('.//{%s}w' % NS):
-
-                        # VB: Added the following two 'if' blocks.
-                        # VB: If a word is a replacement, update the previous
-                        # entry with the replacement info, but do not add the
-                        # current word as an entry.
-                        if skip:
-                            skip = False
-                            entry = sents[-1]
-                            entry.replacement = xmlword.text
-                            sents[-1] = entry
-                            continue
-                        if xmlword.find('.//{%s}replacement' % NS):
-                            skip = True
-
-                        infl = None
-                        suffixStem = None
-                        suffixTag = None
-                        # VB: Removed block for getting replaced words.
-                        # get text
-                        if xmlword.text:
-                            word = xmlword.text
-                        else:
-                            word = ''
-                        # strip tailing space
-                        if strip_space:
-                            word = word.strip()
-                        # stem
-                        infl, stem = '', ''  # VB: Added.
-                        # VB: Removed 'if' clause testing for stem==True.
-                        try:
-                            xmlstem = xmlword.find('.//{%s}stem' % NS)
-                            stem = xmlstem.text  # VB: Changed 'word' to 'stem'.
-                        except AttributeError as e:
-                            pass
-                        # if there is an inflection
-                        try:
-                            xmlinfl = xmlword.find(
-                                './/{%s}mor/{%s}mw/{%s}mk' % (NS, NS, NS)
-                            )
-                            infl_type = ''  # VB: Added infl_type and the try/except clause.
-                            try:
-                                infl_type = xmlinfl.attrib['type']
-                            except ValueError:
-                                pass
-                            infl = xmlinfl.text  # VB: Originally word += '-' + xmlinfl.text
-                        except:
-                            pass
-                        # if there is a suffix
-                        try:
-                            xmlsuffix = xmlword.find(
-                                './/{%s}mor/{%s}mor-post/{%s}mw/{%s}stem'
-                                % (NS, NS, NS, NS)
-                            )
-                            suffixStem = xmlsuffix.text
-                        except AttributeError:
-                            suffixStem = ""
-                        if suffixStem:
-                            word += "~" + suffixStem
-                        # pos
-                        # Removed 'if relation or pos:' check that encloses the code up until the 'relational' comment
-                        try:
-                            xmlpos = xmlword.findall(".//{%s}c" % NS)
-                            xmlpos2 = xmlword.findall(".//{%s}s" % NS)
-                            if xmlpos2 != []:
-                                tag = xmlpos[0].text + ":" + xmlpos2[0].text
-                            else:
-                                tag = xmlpos[0].text
-                        except (AttributeError, IndexError) as e:
-                            tag = ""
-                        try:
-                            xmlsuffixpos = xmlword.findall(
-                                './/{%s}mor/{%s}mor-post/{%s}mw/{%s}pos/{%s}c'
-                                % (NS, NS, NS, NS, NS)
-                            )
-                            xmlsuffixpos2 = xmlword.findall(
-                                './/{%s}mor/{%s}mor-post/{%s}mw/{%s}pos/{%s}s'
-                                % (NS, NS, NS, NS, NS)
-                            )
-                            if xmlsuffixpos2:
-                                suffixTag = (
-                                    xmlsuffixpos[0].text + ":" + xmlsuffixpos2[0].text
-                                )
-                            else:
-                                suffixTag = xmlsuffixpos[0].text
-                        except:
-                            pass
-                        if suffixTag:
-                            tag += "~" + suffixTag
-                        word = Word(word, tag, stem, infl, infl_type)  # VB: Originally 'word = [word, tag]'
-                        # relational
-                        # the gold standard is stored in
-                        # <mor></mor><mor type="trn"><gra type="grt">
-                        # VB: Removed 'if relation == True:' block.
-                        for xmlstem_rel in xmlword.findall(  # VB: From the original 'if relation == True:' block
-                            './/{%s}mor/{%s}gra' % (NS, NS)
-                        ):
-                            word.rel = xmlstem_rel.get('relation')  # VB: Added.
-                        try:
-                            for xmlpost_rel in xmlword.findall(  # VB: From the original 'if relation == True:' block
-                                './/{%s}mor/{%s}mor-post/{%s}gra' % (NS, NS, NS)
-                            ):
-                                word.post_rel = xmlpost_rel.get('relation')  # VB: Added.
-                        except:
-                            pass
-                        sents.append(word)
+                    sents = self._get_morph_sent(xmlsent, strip_space)  # VB: Moved to _get_morph_sent.
                     # VB: Replaced the sent/relation check:
                     # if sent or relation:
                     #     results.append(sents)
                     # else:
                     #     results.extend(sents)
-                    results.append(sents)
-            return LazyMap(lambda x: x, results)
+                    # VB: Optionally keep track of the speaker.
+                    if keep_speaker:
+                        results.append((xmlsent.get('who'), sents))
+                    else:
+                        results.append(sents)
+            return results  # VB: Removed the no-op LazyMap wrapper.
+
+    # VB: Added. A streaming version of _get_morph_words that yields each
+    # utterance as soon as its closing tag has been parsed and then discards
+    # the parsed elements, so that only a single utterance is kept in memory.
+    # If a participants list is given, the (id, age) tuples of the
+    # participants are added to it.
+    def _iter_morph_words(self, fileid, speaker, strip_space,
+                          keep_speaker=False, participants=None):
+        if isinstance(speaker, str) and speaker != 'ALL':
+            speaker = [speaker]
+        with archive.xml_source(fileid) as source:
+            for elem in self._backend.iter_elements(source, (PARTICIPANT_TAG,
+                                                             U_TAG)):
+                if elem.tag == PARTICIPANT_TAG:
+                    if participants is not None:
+                        participants.append((elem.get('id'),
+                                             elem.get('age')))
+                    continue
+                who = elem.get('who')
+                if speaker == 'ALL' or who in speaker:
+                    if profiler.enabled:
+                        start = time.perf_counter()
+                        sents = self._get_morph_sent(elem, strip_space)
+                        profiler.add_time('word extraction',
+                                          time.perf_counter() - start)
+                    else:
+                        sents = self._get_morph_sent(elem, strip_space)
+                    if keep_speaker:
+                        yield who, sents
+                    else:
+                        yield sents
+
+    # From NLTK's _get_words method: the body of the loop over utterances.
+    def _get_morph_sent(self, xmlsent, strip_space):
+            sents = []
+            skip = False  # VB: Skip replacements.
+            for xmlword in xmlsent.findall(W_PATH):
+
+                # VB: Added the following two 'if' blocks.
+                # VB: If a word is a replacement, update the previous
+                # entry with the replacement info, but do not add the
+                # current word as an entry.
+                if skip:
+                    skip = False
+                    entry = sents[-1]
+                    entry.replacement = xmlword.text
+                    sents[-1] = entry
+                    continue
+                # VB: All elements that are needed below are collected in a
+                # single walk over the word (see scan_word) instead of
+                # searching the word once for each of them.
+                (xmlstem, xmlinfl, xmlsuffix, xmlpos, xmlpos2, xmlsuffixpos,
+                 xmlsuffixpos2, xmlrel, xmlpost_rel,
+                 xmlreplacement) = scan_word(xmlword)
+                if xmlreplacement is not None and len(xmlreplacement):
+                    skip = True
+
+                # VB: Removed block for getting replaced words.
+                # get text
+                if xmlword.text:
+                    word = xmlword.text
+                else:
+                    word = ''
+                # strip tailing space
+                if strip_space:
+                    word = word.strip()
+                # stem
+                infl, stem = '', ''  # VB: Added.
+                # VB: Removed 'if' clause testing for stem==True.
+                if xmlstem is not None:
+                    stem = xmlstem.text  # VB: Changed 'word' to 'stem'.
+                # if there is an inflection
+                # VB: Added infl_type. If the inflection has no type, it is
+                # ignored.
+                infl_type = ''
+                if xmlinfl is not None and 'type' in xmlinfl.attrib:
+                    infl_type = xmlinfl.attrib['type']
+                    infl = xmlinfl.text  # VB: Originally word += '-' + xmlinfl.text
+                # if there is a suffix
+                if xmlsuffix is not None and xmlsuffix.text:
+                    word += "~" + xmlsuffix.text
+                # pos
+                # Removed 'if relation or pos:' check that encloses the code up until the 'relational' comment
+                if xmlpos is None:
+                    tag = ""
+                elif xmlpos2 is not None:
+                    tag = xmlpos.text + ":" + xmlpos2.text
+                else:
+                    tag = xmlpos.text
+                suffixTag = None
+                if xmlsuffixpos is not None:
+                    if xmlsuffixpos2 is None:
+                        suffixTag = xmlsuffixpos.text
+                    elif xmlsuffixpos.text is not None \
+                            and xmlsuffixpos2.text is not None:
+                        suffixTag = (
+                            xmlsuffixpos.text + ":" + xmlsuffixpos2.text
+                        )
+                if suffixTag:
+                    tag += "~" + suffixTag
+                word = Word(word, tag, stem, infl, infl_type)  # VB: Originally 'word = [word, tag]'
+                # relational
+                # the gold standard is stored in
+                # <mor></mor><mor type="trn"><gra type="grt">
+                # VB: Removed 'if relation == True:' block.
+                if xmlrel is not None:
+                    word.rel = xmlrel.get('relation')  # VB: Added.
+                if xmlpost_rel is not None:
+                    word.post_rel = xmlpost_rel.get('relation')  # VB: Added.
+                sents.append(word)
+            return sents
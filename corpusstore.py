@@ -0,0 +1,134 @@
+# A read-only, memory-mapped corpus store.
+#
+# The store is a token table (see tokentable.py) that is saved once and then
+# opened with memory-mapped arrays, so that any number of processes (and
+# later runs) can share a single copy of the corpus in the page cache instead
+# of parsing the XML files again or receiving pickled Word objects. The
+# utterances of each file are stored contiguously, so they can be accessed
+# by file (and then filtered by speaker) without reading the rest of the
+# corpus. For iterating over the Words, CorpusStore provides the same
+# methods as CHILDESMorphFileReader.
+
+import copy
+import numpy as np
+# Imports from this repository:
+from tokentable import FIELDS, NO_AGE, TokenTable
+from word import Word
+
+
+class CorpusStore(TokenTable):
+
+    def __init__(self, *args):
+        TokenTable.__init__(self, *args)
+        self.file_ids = {fileid: i for i, fileid in enumerate(self.files)}
+        # The utterances of file i are file_offsets[i]:file_offsets[i + 1].
+        self.file_offsets = np.searchsorted(self.utt_file,
+                                            np.arange(len(self.files) + 1))
+        self._fileids = self.files  # The default files (see view).
+
+    # Opens the store saved in the given directory (see TokenTable.save).
+    @classmethod
+    def open(cls, path):
+        return cls.load(path, mmap=True)
+
+    # Returns a store that shares the arrays of this one, but only contains
+    # the given file(s) by default, like a CHILDESMorphFileReader for these
+    # files.
+    def view(self, fileids):
+        if isinstance(fileids, str):
+            fileids = [fileids]
+        for fileid in fileids:
+            if fileid not in self.file_ids:
+                raise ValueError('File not in the corpus store: {}'
+                                 .format(fileid))
+        store = copy.copy(self)
+        store._fileids = list(fileids)
+        return store
+
+    def fileids(self):
+        return list(self._fileids)
+
+    def _file_indices(self, fileids):
+        if fileids is None:
+            fileids = self._fileids
+        elif isinstance(fileids, str):
+            fileids = [fileids]
+        return [self.file_ids[fileid] for fileid in fileids]
+
+    # The indices of the utterances of the given file(s) and speaker(s).
+    def utterance_ids(self, fileids=None, speaker='ALL'):
+        ids = [np.arange(self.file_offsets[i], self.file_offsets[i + 1])
+               for i in self._file_indices(fileids)]
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        if speaker != 'ALL':
+            ids = ids[np.isin(self.utt_speaker[ids], self.codes(speaker))]
+        return ids
+
+    # The Words of the given tokens.
+    def words(self, token_ids):
+        strings = self.strings
+        return list(map(Word.from_fields,
+                        *([strings[code] for code
+                           in self.columns[field][token_ids].tolist()]
+                          for field in FIELDS)))
+
+    # The age of the child (in months) in each of the given files. Only the
+    # ages in months of the child (analyze.CHILD) are stored.
+    def age(self, fileids=None, speaker='CHI', month=False):
+        if not month or speaker != 'CHI':
+            raise ValueError('The corpus store only contains the ages of the '
+                             'child in months.')
+        return [None if age == NO_AGE else age
+                for age in self.file_age[self._file_indices(fileids)].tolist()]
+
+    # The methods of CHILDESMorphFileReader. The Words are stored as they
+    # were read when the store was built, so strip_space is only accepted for
+    # compatibility.
+
+    def iter_morph_sents(self, fileids=None, speaker='ALL', strip_space=True,
+                         keep_speaker=False):
+        if isinstance(speaker, str) and speaker != 'ALL':
+            speaker = [speaker]
+        # The Words are created file by file.
+        for i in self._file_indices(fileids):
+            utts = self.utterance_ids(self.files[i], speaker)
+            if not len(utts):
+                continue
+            starts = self.utt_offsets[utts]
+            lengths = self.utt_offsets[utts + 1] - starts
+            # The token indices of all of these utterances.
+            token_ids = np.arange(lengths.sum()) + np.repeat(
+                starts - (np.cumsum(lengths) - lengths), lengths)
+            words = self.words(token_ids)
+            start = 0
+            for who, length in zip(self.utt_speaker[utts].tolist(),
+                                   lengths.tolist()):
+                sent = words[start:start + length]
+                start += length
+                if keep_speaker:
+                    yield self.strings[who], sent
+                else:
+                    yield sent
+
+    def tagged_morph_sents(self, fileids=None, speaker='ALL',
+                           strip_space=True):
+        return list(self.iter_morph_sents(fileids, speaker, strip_space))
+
+    def speaker_morph_sents(self, fileids=None, speaker='ALL',
+                            strip_space=True):
+        return list(self.iter_morph_sents(fileids, speaker, strip_space,
+                                          keep_speaker=True))
+
+
+# The stores opened by this process (see open_store).
+_stores = {}
+
+
+# Opens the store in the given directory, or returns it if it has already
+# been opened by this process (e.g. by a worker for a previous file).
+def open_store(path):
+    try:
+        return _stores[path]
+    except KeyError:
+        _stores[path] = CorpusStore.open(path)
+        return _stores[path]
@@ -0,0 +1,226 @@
+# A dense results cube with the axes
+#   matcher x child x session x role (CHI, PAR) x value (occurrences,
+#   utterances).
+#
+# Each child is identified by its corpus and the name of the child in the
+# transcripts (see child_name), and each session is one of its files (in the
+# order of the ages, see from_file_counts). Children with
+# fewer sessions are padded with empty sessions, whose age is NaN and whose
+# counts are 0. Unlike the results dictionaries (see results.py), the cube
+# keeps the counts of every child and session, so that per-child curves or
+# comparisons of corpora do not need another pass over the corpus. The cube
+# can be rolled up into a results dictionary, and exported as NPZ, CSV or
+# Parquet (the latter requires pandas).
+
+import csv
+import os
+import numpy as np
+# Imports from this repository:
+from results import corpus_name, update_results
+
+
+ROLES = ('CHI', 'PAR')
+VALUES = ('occurrences', 'utterances')
+COLUMNS = ['matcher', 'child', 'session', 'file', 'age', 'role',
+           'occurrences', 'utterances']
+
+
+# The child of a file: the name of the child in the transcript (see
+# manifest.build_manifest), prefixed with the corpus of the file (see
+# results.corpus_name). If the transcript does not name the child, the
+# directory of the file is used instead.
+def child_name(f, name=None):
+    if not name:
+        return os.path.dirname(f)
+    corpus = corpus_name(f)
+    return name if corpus is None else '{}/{}'.format(corpus, name)
+
+
+class ResultsCube:
+
+    def __init__(self, matchers, children, data, ages, files, order):
+        self.matchers = list(matchers)  # matcher labels
+        self.children = list(children)
+        # int64 array (matcher, child, session, role, value)
+        self.data = data
+        self.ages = ages  # float array (child, session), NaN for padding
+        self.files = files  # str array (child, session), '' for padding
+        # int array (child, session): the position of the file in the
+        # analysis (-1 for padding), which determines the order of the ages
+        # in the results dictionary.
+        self.order = order
+
+    # Creates the cube from (file, age, counts) tuples, where counts is the
+    # list of [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par] per matcher (see
+    # analyze.count_file). Skipped files (counts=None) are ignored. The names
+    # of the children can be given as a dictionary {file -> name} (see
+    # child_name). The sessions of each child are ordered by age (and files
+    # of the same age by their names).
+    @classmethod
+    def from_file_counts(cls, matchers, file_counts, names=None):
+        kept = [(f, age, counts) for f, age, counts in file_counts
+                if counts is not None]
+        names = names or {}
+        sessions = {}  # child -> indices into kept
+        for i, (f, _, _) in enumerate(kept):
+            sessions.setdefault(child_name(f, names.get(f)), []).append(i)
+        children = sorted(sessions)
+        n_sessions = max([len(ids) for ids in sessions.values()] or [0])
+        child_idx = np.zeros(len(kept), dtype=np.int64)
+        session_idx = np.zeros(len(kept), dtype=np.int64)
+        for c, child in enumerate(children):
+            for s, i in enumerate(sorted(sessions[child],
+                                         key=lambda i: (kept[i][1],
+                                                        kept[i][0]))):
+                child_idx[i] = c
+                session_idx[i] = s
+
+        shape = (len(children), n_sessions)
+        data = np.zeros((len(matchers),) + shape + (2, 2), dtype=np.int64)
+        counts = np.array([counts for _, _, counts in kept],
+                          dtype=np.int64).reshape(len(kept), len(matchers),
+                                                  2, 2)
+        data[:, child_idx, session_idx] = counts.transpose(1, 0, 2, 3)
+        ages = np.full(shape, np.nan)
+        ages[child_idx, session_idx] = [age for _, age, _ in kept]
+        files = np.full(shape, '', dtype=object)
+        files[child_idx, session_idx] = [f for f, _, _ in kept]
+        order = np.full(shape, -1, dtype=np.int64)
+        order[child_idx, session_idx] = np.arange(len(kept))
+        return cls([matcher.label for matcher in matchers], children, data,
+                   ages, files.astype(str), order)
+
+    # --- Slicing and roll-ups.
+
+    # A cube with only the given matcher labels and/or children.
+    def select(self, matchers=None, children=None):
+        m = [self.matchers.index(label) for label in
+             (self.matchers if matchers is None else matchers)]
+        c = [self.children.index(child) for child in
+             (self.children if children is None else children)]
+        return ResultsCube([self.matchers[i] for i in m],
+                           [self.children[i] for i in c],
+                           self.data[m][:, c], self.ages[c], self.files[c],
+                           self.order[c])
+
+    # The corpus of each child (see results.corpus_name), i.e. of its first
+    # session.
+    def child_corpora(self):
+        return [corpus_name(str(f)) for f in self.files[:, 0]]
+
+    # A cube with only the children of the given corpus.
+    def select_corpus(self, corpus):
+        return self.select(children=[
+            child for child, child_corpus in zip(self.children,
+                                                 self.child_corpora())
+            if child_corpus == corpus])
+
+    # The counts summed over the given axes, e.g. sum('child', 'session').
+    def sum(self, *axes):
+        names = ['matcher', 'child', 'session', 'role', 'value']
+        return self.data.sum(axis=tuple(names.index(axis) for axis in axes))
+
+    # The occurrences per utterance of the child (or, if compare_adult, the
+    # ratio of the child's and the parents' occurrences per utterance) for
+    # each matcher, child and session. NaN where there are no (child or
+    # adult) utterances.
+    def rates(self, compare_adult=False):
+        data = self.data.astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = data[..., 0, 0] / data[..., 0, 1]
+            if compare_adult:
+                rate = rate / (data[..., 1, 0] / data[..., 1, 1])
+        rate[~np.isfinite(rate)] = np.nan
+        return rate
+
+    # Sums the counts of all children per age. Returns the ages (in the order
+    # in which they first appear in the analysis), the counts per matcher and
+    # age (matcher, age, role, value), and whether there were any sessions
+    # with child utterances for each matcher and age. Like results.add_counts,
+    # sessions without child utterances are ignored.
+    def by_age(self):
+        c, s = np.nonzero(self.order >= 0)
+        k = np.argsort(self.order[c, s])
+        c, s = c[k], s[k]
+        counts = self.data[:, c, s]  # (matcher, session, role, value)
+        valid = counts[:, :, 0, 1] > 0
+        session_ages = self.ages[c, s][valid.any(axis=0)].astype(np.int64)
+        _, first = np.unique(session_ages, return_index=True)
+        ages = session_ages[np.sort(first)]
+        # The position of each session's age (sessions whose age does not
+        # occur are not valid for any matcher, so they do not add anything).
+        age_pos = {age: i for i, age in enumerate(ages.tolist())}
+        pos = np.array([age_pos.get(age, 0)
+                        for age in self.ages[c, s].tolist()], dtype=np.int64)
+        summed = np.zeros((len(self.matchers), len(ages), 2, 2),
+                          dtype=np.int64)
+        present = np.zeros((len(self.matchers), len(ages)), dtype=np.int64)
+        np.add.at(summed, (slice(None), pos), counts * valid[..., None, None])
+        np.add.at(present, (slice(None), pos), valid)
+        return ages, summed, present > 0
+
+    # The results dictionary (see results.py), identical to the one created
+    # by analyze.analyze_files for the same files.
+    def to_results(self):
+        ages, summed, present = self.by_age()
+        results = {}
+        for a, age in enumerate(ages.tolist()):
+            for m, label in enumerate(self.matchers):
+                if present[m, a]:
+                    results = update_results(results, label, age,
+                                             summed[m, a].ravel().tolist())
+        return results
+
+    # --- Export.
+
+    def save(self, filename):
+        np.savez_compressed(filename, matchers=np.array(self.matchers),
+                            children=np.array(self.children), data=self.data,
+                            ages=self.ages, files=self.files,
+                            order=self.order)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as cube:
+            return cls(cube['matchers'].tolist(), cube['children'].tolist(),
+                       cube['data'], cube['ages'], cube['files'],
+                       cube['order'])
+
+    # The counts as rows (see COLUMNS), without the padding.
+    def records(self):
+        for c, s in zip(*np.nonzero(self.order >= 0)):
+            for m, label in enumerate(self.matchers):
+                for r, role in enumerate(ROLES):
+                    occ, utt = self.data[m, c, s, r].tolist()
+                    yield (label, self.children[c], int(s),
+                           self.files[c, s], int(self.ages[c, s]), role, occ,
+                           utt)
+
+    def to_csv(self, filename):
+        with open(filename, 'w', encoding='utf8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(self.records())
+
+    def to_parquet(self, filename):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError('Exporting to Parquet requires pandas (and '
+                              'pyarrow or fastparquet).')
+        pd.DataFrame(list(self.records()), columns=COLUMNS).to_parquet(
+            filename, index=False)
+
+    # Saves the cube in the format given by the file extension (.npz, .csv
+    # or .parquet).
+    def export(self, filename):
+        ext = os.path.splitext(filename)[1]
+        if ext == '.npz':
+            self.save(filename)
+        elif ext == '.csv':
+            self.to_csv(filename)
+        elif ext == '.parquet':
+            self.to_parquet(filename)
+        else:
+            raise ValueError('Unknown format: {} (use .npz, .csv or '
+                             '.parquet)'.format(filename))
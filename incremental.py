@@ -0,0 +1,119 @@
+# Stores the counts of each (file, matcher) pair between runs, so that only
+# the pairs whose file or matcher changed need to be recomputed.
+#
+# The store is a JSON file:
+# {'version': ..., 'settings': {...},
+#  'files': {file -> {'size': ..., 'mtime': ..., 'sha1': ..., 'age': ...,
+#                     'counts': {matcher signature -> [n_occ_chi, n_utt_chi,
+#                                                      n_occ_par, n_utt_par]}}}}
+# If the file was skipped (no age/too old), 'counts' is None.
+# The counts are only valid for the settings (speakers, age limit, parser
+# version) they were computed with, so changing these discards the store.
+
+import json
+import os
+# Imports from this repository:
+from archive import file_stat
+from cache import file_hash
+from results import add_counts
+
+
+STORE_VERSION = 1
+
+
+class IncrementalStore:
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.files = {}
+        try:
+            with open(path, encoding='utf8') as f:
+                store = json.load(f)
+        except (OSError, ValueError):
+            return
+        if store['version'] == STORE_VERSION \
+           and store['settings'] == settings:
+            self.files = store['files']
+
+    # Saves the store. If files/matchers are given, entries for other files
+    # and matchers are removed.
+    def save(self, files=None, matchers=None):
+        if files is not None:
+            self.files = {f: self.files[f] for f in files if f in self.files}
+        if matchers is not None:
+            signatures = set(matcher.signature() for matcher in matchers)
+            for entry in self.files.values():
+                if entry['counts'] is not None:
+                    entry['counts'] = {sig: counts for sig, counts
+                                       in entry['counts'].items()
+                                       if sig in signatures}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'version': STORE_VERSION, 'settings': self.settings,
+                       'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
+    # Returns the valid entry for the file, or None if the file is new or
+    # has changed. The content hash is only computed if the size or mtime
+    # of the file changed.
+    def entry(self, f, path):
+        try:
+            entry = self.files[f]
+        except KeyError:
+            return None
+        size, mtime = file_stat(path)
+        if entry['size'] == size and entry['mtime'] == mtime:
+            return entry
+        if entry['sha1'] != file_hash(path):
+            del self.files[f]
+            return None
+        entry['size'] = size
+        entry['mtime'] = mtime
+        return entry
+
+    # The matchers for which there are no counts for the file yet.
+    def missing(self, f, path, matchers):
+        entry = self.entry(f, path)
+        if entry is None:
+            return matchers
+        if entry['counts'] is None:  # The file is skipped anyway.
+            return []
+        return [matcher for matcher in matchers
+                if matcher.signature() not in entry['counts']]
+
+    def update(self, f, path, matchers, age, counts):
+        entry = self.entry(f, path)
+        if entry is None:
+            size, mtime = file_stat(path)
+            entry = {'size': size, 'mtime': mtime,
+                     'sha1': file_hash(path), 'age': age, 'counts': {}}
+            self.files[f] = entry
+        if counts is None:
+            entry['counts'] = None
+            return
+        for matcher, matcher_counts in zip(matchers, counts):
+            entry['counts'][matcher.signature()] = matcher_counts
+
+    # The stored (age, counts) tuple of each file (see analyze.count_file).
+    def file_counts(self, files, matchers):
+        file_counts = []
+        for f in files:
+            entry = self.files[f]
+            if entry['counts'] is None:
+                file_counts.append((entry['age'], None))
+            else:
+                file_counts.append((entry['age'],
+                                    [entry['counts'][matcher.signature()]
+                                     for matcher in matchers]))
+        return file_counts
+
+    # Merges the stored counts into the results dictionary, in the same order
+    # as a full run would.
+    def results(self, files, matchers, results=None):
+        if results is None:
+            results = {}
+        for age, counts in self.file_counts(files, matchers):
+            if counts is not None:
+                results = add_counts(results, matchers, age, counts)
+        return results
@@ -0,0 +1,131 @@
+# An inverted index over the Word attributes of a token table.
+#
+# For each indexed attribute, the index maps every value (string code) to the
+# sorted list of tokens with that value. The postings of an attribute are
+# stored as a single array of token indices that is sorted by value, together
+# with the start offset of each value (like a CSR matrix). Each token index
+# can be resolved to its (file, utterance, token, speaker) location.
+#
+# Matchers are evaluated by intersecting the posting lists of their
+# constraints instead of scanning the whole corpus.
+
+import os
+import numpy as np
+# Imports from this repository:
+from tokentable import TokenTable
+
+
+INDEXED_FIELDS = ['form', 'tag', 'stem', 'infl', 'infl_type', 'rel',
+                  'post_rel', 'sfx_tag', 'sfx_form', 'replacement']
+
+
+class CorpusIndex(TokenTable):
+
+    # The arguments are the same as for TokenTable. If postings are not
+    # given, they are created from the token columns.
+    def __init__(self, *args, postings=None):
+        TokenTable.__init__(self, *args)
+        if postings is None:
+            postings = {field: self.build_postings(field)
+                        for field in INDEXED_FIELDS}
+        self.postings = postings  # field -> (token indices, start offsets)
+
+    @classmethod
+    def from_table(cls, table):
+        return cls(*table.args())
+
+    def build_postings(self, field):
+        col = self.columns[field]
+        # A stable sort keeps the token indices of each value sorted.
+        order = np.argsort(col, kind='stable').astype(np.int64)
+        starts = np.zeros(len(self.strings) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(col, minlength=len(self.strings)),
+                  out=starts[1:])
+        return order, starts
+
+    def save(self, path, provenance=None):
+        TokenTable.save(self, path, provenance)
+        for field, (order, starts) in self.postings.items():
+            np.save(os.path.join(path, 'index_{}_order.npy'.format(field)),
+                    order)
+            np.save(os.path.join(path, 'index_{}_starts.npy'.format(field)),
+                    starts)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        postings = {}
+        for field in INDEXED_FIELDS:
+            postings[field] = tuple(
+                np.load(os.path.join(path, 'index_{}_{}.npy'.format(field,
+                                                                    part)),
+                        mmap_mode='r' if mmap else None)
+                for part in ('order', 'starts'))
+        return cls(*cls.load_args(path, mmap), postings=postings)
+
+    # The (sorted) indices of all tokens whose value for the field is one of
+    # the given string codes.
+    def posting_list(self, field, codes):
+        order, starts = self.postings[field]
+        lists = [order[starts[code]:starts[code + 1]] for code in codes]
+        if len(lists) == 1:
+            return lists[0]
+        if not lists:
+            return np.zeros(0, dtype=np.int64)
+        # The lists are disjoint, so they only need to be sorted.
+        return np.sort(np.concatenate(lists))
+
+    def code_list(self, predicate):
+        return np.flatnonzero(self.vocab_mask(predicate))
+
+    # The index-based equivalent of TokenTable.match_ids.
+    def match_ids(self, matcher):
+        lists = []
+        for field in ('form', 'infl', 'rel', 'post_rel', 'sfx_tag', 'tag',
+                      'stem'):
+            if getattr(matcher, field):
+                lists.append(self.posting_list(
+                    field, self.codes(getattr(matcher, field))))
+        if matcher.infl_affix:
+            lists.append(self.posting_list('infl_type', self.codes('sfx')))
+        if matcher.infl_fusion:
+            lists.append(self.posting_list('infl_type', self.codes('sfxf')))
+        if matcher.suffix:
+            suffix = matcher.suffix
+            if not isinstance(suffix, str):
+                suffix = tuple(suffix)
+            lists.append(self.posting_list('form', self.code_list(
+                lambda string: string is not None
+                and string.endswith(suffix))))
+        if lists:
+            # Start with the shortest list to keep the intersections small.
+            lists.sort(key=len)
+            token_ids = lists[0]
+            for other in lists[1:]:
+                token_ids = np.intersect1d(token_ids, other,
+                                           assume_unique=True)
+        else:
+            token_ids = np.arange(len(self), dtype=np.int64)
+        replacements = self.posting_list(
+            'replacement', self.code_list(lambda string: bool(string)))
+        if len(replacements):
+            token_ids = np.setdiff1d(token_ids, replacements,
+                                     assume_unique=True)
+        return token_ids
+
+    # Returns the (file, utterance, token, speaker) locations of the given
+    # tokens. The utterance index is relative to the file and the token
+    # index is relative to the utterance.
+    def locations(self, token_ids):
+        utts = self.token_utt[token_ids]
+        files = self.utt_file[utts]
+        # The index of the first utterance of each file.
+        file_starts = np.searchsorted(self.utt_file,
+                                      np.arange(len(self.files)))
+        return [(self.files[f], int(u - file_starts[f]),
+                 int(t - self.utt_offsets[u]), self.strings[s])
+                for f, u, t, s in zip(files, utts, token_ids,
+                                      self.utt_speaker[utts])]
+
+    # Where does the matcher occur?
+    def find(self, matcher):
+        return self.locations(self.match_ids(matcher))
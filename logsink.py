@@ -0,0 +1,127 @@
+# Buffered, structured logging for the analysis.
+#
+# All messages are sent to the 'childes' logger, whose handler only puts the
+# records into a queue. A background thread in the main process (a
+# QueueListener) writes them to the console and, optionally, to a log file
+# with one JSON object per line. Worker processes send their records to the
+# same queue (see init_worker), so printing never blocks the analysis.
+#
+# Levels: DEBUG for every matched sentence, INFO for the progress and the
+# counts per file, WARNING for skipped files and empty months. The DEBUG
+# records can be sampled, so that only every n-th of them is kept.
+
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import sys
+
+
+LOGGER_NAME = 'childes'
+logger = logging.getLogger(LOGGER_NAME)
+logger.propagate = False
+
+# The settings of the running listener (see worker_args).
+_queue = None
+_level = logging.INFO
+_sample = 1
+
+
+# Keeps every n-th record at or below the given level, and all other records.
+class SampleFilter(logging.Filter):
+
+    def __init__(self, every=1, level=logging.DEBUG):
+        logging.Filter.__init__(self)
+        self.every = every
+        self.level = level
+        self.seen = 0
+
+    def filter(self, record):
+        if self.every <= 1 or record.levelno > self.level:
+            return True
+        self.seen += 1
+        return (self.seen - 1) % self.every == 0
+
+
+# Only lets through records below the given level.
+class MaxLevelFilter(logging.Filter):
+
+    def __init__(self, level):
+        logging.Filter.__init__(self)
+        self.level = level
+
+    def filter(self, record):
+        return record.levelno < self.level
+
+
+# One JSON object per record. Structured fields can be added to a record with
+# extra={'data': {...}}.
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname,
+                 'process': record.processName,
+                 'message': record.getMessage()}
+        data = getattr(record, 'data', None)
+        if data is not None:
+            entry['data'] = data
+        return json.dumps(entry)
+
+
+# Sends the records of this process to the queue.
+def configure(queue, level=logging.INFO, sample=1):
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for log_filter in list(logger.filters):
+        logger.removeFilter(log_filter)
+    logger.setLevel(level)
+    if queue is not None:
+        logger.addHandler(logging.handlers.QueueHandler(queue))
+    if sample > 1:
+        logger.addFilter(SampleFilter(sample))
+
+
+# Starts the background writer and returns it (see stop). Messages below
+# WARNING are written to stdout and the others to stderr. If a filename is
+# given, all messages are also written to this file as JSON.
+def start(filename=None, level=logging.INFO, sample=1):
+    global _queue, _level, _sample
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    _queue = multiprocessing.Queue()
+    _level = level
+    _sample = sample
+    stdout = logging.StreamHandler(sys.stdout)
+    stdout.addFilter(MaxLevelFilter(logging.WARNING))
+    stderr = logging.StreamHandler(sys.stderr)
+    stderr.setLevel(logging.WARNING)
+    handlers = [stdout, stderr]
+    if filename is not None:
+        log_file = logging.FileHandler(filename, mode='w', encoding='utf8')
+        log_file.setFormatter(JsonFormatter())
+        handlers.append(log_file)
+    listener = logging.handlers.QueueListener(_queue, *handlers,
+                                              respect_handler_level=True)
+    configure(_queue, level, sample)
+    listener.start()
+    return listener
+
+
+# Writes the remaining messages and stops the background writer.
+def stop(listener):
+    global _queue
+    configure(None, _level)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    _queue = None
+
+
+# The arguments of init_worker for the worker processes.
+def worker_args():
+    return _queue, _level, _sample
+
+
+# The initializer of worker processes (ProcessPoolExecutor(initializer=...)).
+def init_worker(queue, level, sample):
+    configure(queue, level, sample)
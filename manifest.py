@@ -0,0 +1,88 @@
+# A fast metadata scan of CHILDES transcripts.
+#
+# Only the <Participants> header of each transcript is parsed: the scan stops
+# as soon as the first utterance starts. This is enough to determine the age
+# of the child, its name and the speakers, so that files can be selected before any of
+# them are fully parsed. For the selected files, the utterances per speaker
+# can additionally be counted with a plain text search (without parsing the
+# XML). The transcripts can also be read from archives (see archive.py).
+
+import json
+import re
+from xml.etree import ElementTree
+from archive import open_file  # Import from this repository.
+
+
+NS = 'http://www.talkbank.org/ns/talkbank'
+PARTICIPANT_TAG = '{%s}participant' % NS
+U_TAG = '{%s}u' % NS
+U_PATTERN = re.compile(rb'<u\s[^>]*?who="([^"]*)"')
+
+
+# Calculates the age in months from a string in CHILDES format, like NLTK's
+# CHILDESCorpusReader.convert_age. Returns None for missing/malformed ages.
+def convert_age(age):
+    if age is None:
+        return None
+    m = re.match(r'P(\d+)Y(\d+)M?(\d?\d?)D?', age)
+    if m is None:
+        return None
+    age_month = int(m.group(1)) * 12 + int(m.group(2))
+    if m.group(3) and int(m.group(3)) > 15:
+        age_month += 1
+    return age_month
+
+
+# Returns the (id, name, age) tuples of the participants listed in the
+# header.
+def scan_participants(path):
+    participants = []
+    with open_file(path) as f:
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == U_TAG:
+                    break
+            elif elem.tag == PARTICIPANT_TAG:
+                participants.append((elem.get('id'), elem.get('name'),
+                                     elem.get('age')))
+    return participants
+
+
+# Returns the number of utterances per speaker.
+def count_utterances(path):
+    counts = {}
+    with open_file(path) as f:
+        for who in U_PATTERN.findall(f.read()):
+            who = who.decode('utf8')
+            counts[who] = counts.get(who, 0) + 1
+    return counts
+
+
+# Returns an entry for each file: {'file': ..., 'age': age of the child in
+# months (or None), 'name': name of the child (or None), 'speakers': [...],
+# 'utterances': {speaker -> count}}.
+# Utterances are only counted for the files for which select(age) is true
+# (and are None for the other files).
+def build_manifest(data_path, files, child='CHI', select=None):
+    manifest = []
+    for f in files:
+        path = '{}/{}'.format(data_path, f)
+        participants = scan_participants(path)
+        age = name = None
+        for pat_id, pat_name, pat_age in participants:
+            if pat_id == child:  # Like NLTK, use the first entry.
+                age = convert_age(pat_age)
+                name = pat_name
+                break
+        entry = {'file': f, 'age': age, 'name': name,
+                 'speakers': [pat_id for pat_id, _, _ in participants],
+                 'utterances': None}
+        if select is None or select(age):
+            entry['utterances'] = count_utterances(path)
+        manifest.append(entry)
+    return manifest
+
+
+def save_manifest(manifest, filename):
+    with open(filename, 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=1)
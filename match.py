@@ -1,8 +1,20 @@
+import hashlib
+import json
+import os
+from operator import attrgetter
+
+
+# Hashes a JSON-serializable description of a matcher.
+def hash_description(description):
+    return hashlib.sha1(json.dumps(description, sort_keys=True)
+                        .encode('utf8')).hexdigest()
+
+
 class Matcher:
 
     __slots__ = ['label', 'form', 'infl', 'infl_affix', 'infl_fusion',
                  'suffix', 'rel', 'post_rel', 'sfx', 'sfx_tag',
-                 'tag', 'stem']
+                 'tag', 'stem', '_checks']
 
     def __init__(self, label,
                  form=None, infl=None, infl_affix=None, infl_fusion=None,
@@ -24,73 +36,89 @@ class Matcher:
         self.stem = stem
         self.sfx = sfx
         self.sfx_tag = sfx_tag
+        # The attributes should not be changed after this point, since the
+        # compiled checks would not be updated.
+        self._checks = self.compile()
 
-    def match(self, entry):
-        if entry.replacement:
-            return False
+    # Returns the checks for all attributes that are set, as a tuple of
+    # functions that take an entry and return a boolean.
+    def compile(self):
+        return tuple(check for _, check in self.predicates())
+
+    # Returns the checks for all attributes that are set as (key, check)
+    # pairs. The key identifies the check, so that matchers with the same
+    # checks can share them (see queryplan.py).
+    def predicates(self):
+        predicates = []
         for attr in self.__slots__:
-            if not getattr(self, attr):  # Value is None/False -> skip.
+            val = getattr(self, attr, None)
+            if not val:  # Value is None/False -> skip.
                 continue
-            try:
-                if not getattr(self, 'match_' + attr)(entry):
-                    return False
-            except AttributeError:
-                pass
-        return True
+            if attr in ('form', 'infl', 'rel', 'post_rel', 'sfx_tag', 'tag',
+                        'stem'):
+                # Duplicate values are removed, so that the key lists each
+                # value once (see queryplan.py).
+                key = (attr, val if isinstance(val, str)
+                       else tuple(sorted(set(val))))
+                predicates.append((key,
+                                   self.compile_identity_or_in(attr, val)))
+            elif attr == 'suffix':
+                if not isinstance(val, str):
+                    val = tuple(sorted(set(val)))
+                predicates.append((('suffix', val),
+                                   lambda entry, sfx=val:
+                                   entry.form.endswith(sfx)))
+            # https://talkbank.org/manuals/MOR.html#Mor_Markers_Suffix
+            elif attr == 'infl_affix':
+                # Morphologically/phonologically distinct inflectional affix.
+                predicates.append((('infl_type', 'sfx'),
+                                   lambda entry: entry.infl_type == 'sfx'))
+            elif attr == 'infl_fusion':
+                # Inflectional morpheme(s) that is (are) fused with the stem.
+                # https://talkbank.org/manuals/MOR.html#Mor_Markers_Suffix_Fusional
+                predicates.append((('infl_type', 'sfxf'),
+                                   lambda entry: entry.infl_type == 'sfxf'))
+            # There are no checks for 'label' and 'sfx'. (Word objects do
+            # not have an 'sfx' attribute; the suffix is stored as 'sfx_form'.)
+        return predicates
 
-    def check_identity_or_in(self, entry, attr):
-        comp = getattr(self, attr)
-        entry_comp = getattr(entry, attr)
+    @staticmethod
+    def compile_identity_or_in(attr, comp):
+        get = attrgetter(attr)
         if isinstance(comp, str):
-            return comp == entry_comp
-        for elem in comp:
-            if elem == entry_comp:
-                return True
-        return False
-
-    def match_form(self, entry):
-        return self.check_identity_or_in(entry, 'form')
-
-    def match_tag(self, entry):
-        return self.check_identity_or_in(entry, 'tag')
-
-    def match_sfx_tag(self, entry):
-        return self.check_identity_or_in(entry, 'sfx_tag')
-
-    def match_stem(self, entry):
-        return self.check_identity_or_in(entry, 'stem')
+            return lambda entry: get(entry) == comp
+        comp = frozenset(comp)
+        return lambda entry: get(entry) in comp
 
-    def match_suffix(self, entry):
-        if isinstance(self.suffix, str):
-            return entry.form.endswith(self.suffix)
-        for sfx in self.suffix:
-            if entry.form.endswith(sfx):
-                return True
-        return False
-
-    def match_rel(self, entry):
-        return self.check_identity_or_in(entry, 'rel')
-
-    def match_post_rel(self, entry):
-        return self.check_identity_or_in(entry, 'post_rel')
+    def match(self, entry):
+        if entry.replacement:
+            return False
+        for check in self._checks:
+            if not check(entry):
+                return False
+        return True
 
-    # https://talkbank.org/manuals/MOR.html#Mor_Markers_Suffix
-    def match_infl(self, entry, infl_type=None):
-        return self.check_identity_or_in(entry, 'infl')
+    # The compiled checks cannot be pickled, so they are recompiled instead.
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__
+                if attr != '_checks'}
 
-    # Morphologically/phonologically distinct inflectional affix.
-    # https://talkbank.org/manuals/MOR.html#Mor_Markers_Suffix
-    def match_infl_affix(self, entry):
-        return entry.infl_type == 'sfx'
+    def __setstate__(self, state):
+        for attr, val in state.items():
+            setattr(self, attr, val)
+        self._checks = self.compile()
 
-    # Inflectional morpheme(s) that is (are) fused with the stem.
-    # https://talkbank.org/manuals/MOR.html#Mor_Markers_Suffix_Fusional
-    def match_infl_fusion(self, entry):
-        return entry.infl_type == 'sfxf'
+    # Identifies the constraints of the matcher (but not its label).
+    def signature(self):
+        state = self.__getstate__()
+        del state['label']
+        return hash_description(['Matcher', state])
 
     def __str__(self):
         attributes = []
         for attr in self.__slots__:
+            if attr == '_checks':
+                continue
             val = getattr(self, attr)
             if val is None:
                 continue
@@ -98,40 +126,158 @@ class Matcher:
         return 'Matcher{}'.format(attributes)
 
 
+# Features of an utterance that are shared by all sentence-level matchers
+# (see SentenceMatcher): each is computed the first time it is needed and then
+# reused, so that additional matchers and conditions do not scan the
+# utterance again.
+class UtteranceFeatures:
+
+    __slots__ = ['sent', 'last', '_final', '_first']
+
+    # The first-match indices can be given if they are already known (see
+    # queryplan.QueryPlan).
+    def __init__(self, sent, first=None):
+        self.sent = sent
+        self.last = len(sent) - 1
+        self._final = None
+        self._first = {} if first is None else first  # matcher key -> index
+
+    # The index of the first entry matched by the matcher (-1 if there is
+    # none). Matchers with the same key (see SentenceMatcher) share the index.
+    def first(self, matcher, key=None):
+        if key is None:
+            key = id(matcher)
+        try:
+            return self._first[key]
+        except KeyError:
+            self._first[key] = -1
+            for i, entry in enumerate(self.sent):
+                if matcher.match(entry):
+                    self._first[key] = i
+                    break
+            return self._first[key]
+
+    # The index of the last entry that is not a final punctuation mark.
+    @property
+    def final(self):
+        if self._final is None:
+            self._final = self.last
+            if self.sent and self.sent[-1].tag == 'PUNCT':
+                self._final -= 1
+        return self._final
+
+    def negated_or_past(self, i):
+        return self.sent[i].sfx_tag == 'neg' or self.sent[i].infl == 'PAST'
+
+
+# The conditions of sentence-level matchers: name -> function that takes the
+# (token) matcher, its key and the UtteranceFeatures and returns a boolean.
+# Further conditions can be added with the register_condition decorator.
+CONDITIONS = {}
+
+
+def register_condition(name):
+    def register(function):
+        CONDITIONS[name] = function
+        return function
+    return register
+
+
+@register_condition('uncontractible')
+def uncontractible(matcher, key, features):
+    match = features.first(matcher, key)
+
+    # No uncontracted copula/auxiliary verb.
+    if match == -1:
+        return False
+
+    if features.negated_or_past(match):
+        return True
+
+    # Sentence-initial/final copula/aux.
+    if match == 0 or match == features.last or match == features.final:
+        return True
+
+    # We cannot easily determine whether it's (un)contractible.
+    return False
+
+
 class SentenceMatcher:
 
-    __slots__ = ['matcher', 'condition', 'label']
+    __slots__ = ['matcher', 'condition', 'label', 'key']
 
     def __init__(self, matcher, condition):
+        if condition not in CONDITIONS:
+            raise ValueError('Unknown condition: {}'.format(condition))
         self.matcher = matcher
         self.condition = condition
         self.label = matcher.label
+        # Identifies the token matcher in the UtteranceFeatures.
+        self.key = matcher.signature()
 
-    def match(self, sent):
-        return getattr(self, 'match_' + self.condition)(sent)
+    # If the features of the utterance are given, they are shared with the
+    # other sentence-level matchers.
+    def match(self, sent, features=None):
+        if features is None:
+            features = UtteranceFeatures(sent)
+        return CONDITIONS[self.condition](self.matcher, self.key, features)
 
-    def match_uncontractible(self, sent):
-        match = -1
-        for i, entry in enumerate(sent):
-            if self.matcher.match(entry):
-                if entry.sfx_tag == 'neg' or entry.infl == 'PAST':
-                    return True
-                match = i
-                break
-
-        # No uncontracted copula/auxiliary verb.
-        if match == - 1:
-            return False
-
-        # Sentence-initial/final copula/aux.
-        sent_last = len(sent) - 1
-        if match == 0 or match == sent_last \
-           or (match == sent_last - 1 and sent[-1].tag == 'PUNCT'):
-            return True
-
-        # We cannot easily determine whether it's (un)contractible.
-        return False
+    def signature(self):
+        return hash_description(['SentenceMatcher', self.condition,
+                                 self.matcher.signature()])
 
     def __str__(self):
         return 'SentenceMatcher({}, {})' \
                .format(self.matcher, self.condition)
+
+
+# Creates a Matcher, or a SentenceMatcher if the definition has a
+# 'condition', from a dictionary with the arguments of Matcher.
+def matcher_from_dict(definition):
+    definition = dict(definition)
+    condition = definition.pop('condition', None)
+    try:
+        matcher = Matcher(**definition)
+    except TypeError as e:
+        raise ValueError('Invalid matcher definition {}: {}'
+                         .format(definition, e))
+    if condition is None:
+        return matcher
+    return SentenceMatcher(matcher, condition)
+
+
+# The definition of a matcher, i.e. the inverse of matcher_from_dict.
+def matcher_to_dict(matcher):
+    if isinstance(matcher, SentenceMatcher):
+        definition = matcher_to_dict(matcher.matcher)
+        definition['condition'] = matcher.condition
+        return definition
+    return {attr: val for attr, val in matcher.__getstate__().items()
+            if val is not None}
+
+
+# Loads the matchers from a JSON, TOML or YAML file (the latter requires
+# PyYAML): a list of matcher definitions (see matcher_from_dict), or a
+# dictionary with this list as 'matchers' (e.g. [[matchers]] in TOML).
+def load_matchers(filename):
+    ext = os.path.splitext(filename)[1]
+    if ext == '.json':
+        with open(filename, encoding='utf8') as f:
+            definitions = json.load(f)
+    elif ext == '.toml':
+        import tomllib
+        with open(filename, 'rb') as f:
+            definitions = tomllib.load(f)
+    elif ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('Loading matchers from YAML requires PyYAML.')
+        with open(filename, encoding='utf8') as f:
+            definitions = yaml.safe_load(f)
+    else:
+        raise ValueError('Unknown format: {} (use .json, .toml or .yaml)'
+                         .format(filename))
+    if isinstance(definitions, dict):
+        definitions = definitions['matchers']
+    return [matcher_from_dict(definition) for definition in definitions]
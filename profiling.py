@@ -0,0 +1,136 @@
+# Lightweight instrumentation for the analysis pipeline.
+#
+# The module-level profiler is disabled by default, in which case all of its
+# methods return immediately. When it is enabled (analyze.py --profile), it
+# collects timers per stage, per file and per matcher, as well as counters
+# (files, utterances, tokens, cache hits, ...). The results can be written
+# as a JSON report and summarized in a human-readable form. Some stages are
+# part of others: 'word extraction' happens while 'reading' the XML files,
+# and 'printing' (verbose output) happens while 'matching'.
+
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profiler:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.stages = {}  # stage -> [seconds, calls]
+        self.counters = {}  # name -> count
+        self.files = {}  # file -> {'seconds': ..., 'utterances': ..., ...}
+        self.matchers = {}  # matcher label -> seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, stage, seconds, calls=1):
+        if self.enabled:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def add_matcher_time(self, label, seconds):
+        if self.enabled:
+            self.matchers[label] = self.matchers.get(label, 0.0) + seconds
+
+    def add_file(self, f, seconds, **counts):
+        if self.enabled:
+            entry = self.files.setdefault(f, {'seconds': 0.0})
+            entry['seconds'] += seconds
+            for name, n in counts.items():
+                entry[name] = entry.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, stage):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    # Wraps an iterator so that the time spent producing its items is added
+    # to the stage.
+    def timed_iter(self, stage, iterator):
+        if not self.enabled:
+            return iterator
+        return self._timed_iter(stage, iter(iterator))
+
+    def _timed_iter(self, stage, iterator):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def report(self):
+        return {'wall_seconds': time.perf_counter() - self.start,
+                'stages': {stage: {'seconds': seconds, 'calls': calls}
+                           for stage, (seconds, calls)
+                           in self.stages.items()},
+                'counters': dict(self.counters),
+                'files': self.files,
+                'matchers': self.matchers}
+
+    # Adds a report (e.g. from a worker process) to this profiler.
+    def merge(self, report):
+        for stage, entry in report['stages'].items():
+            self.add_time(stage, entry['seconds'], entry['calls'])
+        for name, n in report['counters'].items():
+            self.count(name, n)
+        for f, entry in report['files'].items():
+            entry = dict(entry)
+            self.add_file(f, entry.pop('seconds'), **entry)
+        for label, seconds in report['matchers'].items():
+            self.add_matcher_time(label, seconds)
+
+    def write_json(self, filename):
+        report = self.report()
+        tokens = report['counters'].get('tokens', 0)
+        report['tokens_per_second'] = tokens / report['wall_seconds']
+        with open(filename, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+
+    def summary(self, n_slowest=5):
+        report = self.report()
+        wall = report['wall_seconds']
+        lines = ['--- Profile ({:.2f} s wall time)'.format(wall)]
+        counters = report['counters']
+        for name in sorted(counters):
+            lines.append('{:>24}: {}'.format(name, counters[name]))
+        if 'tokens' in counters:
+            lines.append('{:>24}: {:.0f}'.format('tokens per second',
+                                                 counters['tokens'] / wall))
+        lines.append('Stages (seconds, calls; summed over all processes):')
+        for stage, entry in sorted(report['stages'].items(),
+                                   key=lambda item: -item[1]['seconds']):
+            lines.append('{:>24}: {:8.3f} s {:>10}'.format(
+                stage, entry['seconds'], entry['calls']))
+        if report['matchers']:
+            lines.append('Matchers:')
+            for label, seconds in sorted(report['matchers'].items(),
+                                         key=lambda item: -item[1]):
+                lines.append('{:>8.3f} s  {}'.format(seconds, label))
+        if report['files']:
+            lines.append('Slowest files:')
+            for f, entry in sorted(report['files'].items(),
+                                   key=lambda item: -item[1]['seconds']
+                                   )[:n_slowest]:
+                lines.append('{:>8.3f} s  {}'.format(entry['seconds'], f))
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
@@ -0,0 +1,170 @@
+# Evaluation plans for a list of matchers.
+#
+# The checks of all matchers are split into predicates (see
+# Matcher.predicates), and predicates that occur in several matchers (e.g.
+# infl_type == 'sfx' or stem == 'be') are evaluated at most once per token.
+# The predicates of each matcher are checked in the order of their
+# selectivity, so that most tokens are rejected by the first check. The
+# fraction of tokens that pass each predicate is measured on a sample of the
+# corpus if one is given, and otherwise taken from the estimates below.
+# Sentence-level matchers (see match.SentenceMatcher) get the index of their
+# first match from the same pass over the tokens.
+
+import time
+from operator import attrgetter
+# Imports from this repository:
+from match import SentenceMatcher, UtteranceFeatures
+
+
+# The estimated fraction of tokens that pass a check of the attribute (for a
+# single value).
+SELECTIVITY = {'form': 0.01, 'stem': 0.02, 'sfx_tag': 0.02, 'infl': 0.05,
+               'tag': 0.1, 'rel': 0.1, 'post_rel': 0.1, 'infl_type': 0.2,
+               'suffix': 0.3, 'replacement': 0.99}
+# The relative cost of the checks (1 if not given).
+COST = {'suffix': 2.0}
+
+# The attributes whose checks can be looked up by value (see QueryPlan).
+INDEXED = ('form', 'infl', 'rel', 'post_rel', 'sfx_tag', 'tag', 'stem',
+           'infl_type')
+
+NO_REPLACEMENT = (('replacement', ''), lambda entry: not entry.replacement)
+
+
+class QueryPlan:
+
+    # If a sample of entries (Words) is given, the selectivity of the
+    # predicates is measured on it.
+    def __init__(self, matchers, sample=None):
+        self.matchers = matchers
+        self.keys = []  # predicate keys
+        self.checks = []  # the predicate functions
+        index = {}  # predicate key -> index
+        chains = []
+        for matcher in matchers:
+            if isinstance(matcher, SentenceMatcher):
+                matcher = matcher.matcher
+            chain = []
+            for key, check in [NO_REPLACEMENT] + matcher.predicates():
+                if key not in index:
+                    index[key] = len(self.keys)
+                    self.keys.append(key)
+                    self.checks.append(check)
+                if index[key] not in chain:
+                    chain.append(index[key])
+            chains.append(chain)
+        self.selectivity = self.estimate(sample)
+        rank = [COST.get(key[0], 1.0) / max(1.0 - selectivity, 1e-6)
+                for key, selectivity in zip(self.keys, self.selectivity)]
+        # The predicate indices of each matcher, in the order in which they
+        # are checked.
+        self.chains = [tuple(sorted(chain, key=lambda p: rank[p]))
+                       for chain in chains]
+        # What is evaluated per token: (rest of the chain, index of the
+        # matcher, None) for token matchers and (rest of the chain, None, key)
+        # for the first match of the token matchers of sentence-level
+        # matchers (once per key).
+        self.targets = []
+        self.sentence_matchers = []
+        # key -> indices of the sentence-level matchers with that key
+        self.key_matchers = {}
+        for i, (matcher, chain) in enumerate(zip(matchers, self.chains)):
+            if not isinstance(matcher, SentenceMatcher):
+                self.targets.append((chain, i, None))
+                continue
+            self.sentence_matchers.append((i, matcher))
+            if matcher.key not in self.key_matchers:
+                self.key_matchers[matcher.key] = []
+                self.targets.append((chain, None, matcher.key))
+            self.key_matchers[matcher.key].append(i)
+        self.first_keys = sorted(self.key_matchers)
+        # The targets are found by their first (i.e. most selective)
+        # predicate: if it is a check of an attribute against one or more
+        # values, the value of the attribute is looked up in a table (one
+        # lookup per attribute for all targets). The other targets are
+        # checked for every token.
+        tables = {}  # attribute -> {value -> target indices}
+        self.unindexed = []
+        for t, (chain, i, key) in enumerate(self.targets):
+            attr, val = self.keys[chain[0]]
+            if attr not in INDEXED:
+                self.unindexed.append(t)
+                continue
+            table = tables.setdefault(attr, {})
+            for value in ([val] if isinstance(val, str) else val):
+                table.setdefault(value, []).append(t)
+            self.targets[t] = (chain[1:], i, key)
+        self.tables = [(attrgetter(attr), table)
+                       for attr, table in sorted(tables.items())]
+
+    # The fraction of tokens that pass each predicate.
+    def estimate(self, sample=None):
+        if sample:
+            return [sum(1 for entry in sample if check(entry)) / len(sample)
+                    for check in self.checks]
+        return [min(1.0, SELECTIVITY.get(attr, 0.5)
+                    * (1 if isinstance(val, str) else len(val)))
+                for attr, val in self.keys]
+
+    # The number of occurrences of each matcher in the sentence (for
+    # sentence-level matchers 0 or 1). If a list with one entry per matcher
+    # is given, the time spent on the checks of each matcher is added to it
+    # (the checks of the token matcher of sentence-level matchers with the
+    # same key are shared, so their time is added to each of them).
+    def count(self, sent, seconds=None):
+        checks = self.checks
+        targets = self.targets
+        counts = [0] * len(self.matchers)
+        first = {}  # key -> index of the first match
+        for pos, entry in enumerate(sent):
+            candidates = self.unindexed
+            for get, table in self.tables:
+                try:
+                    candidates = candidates + table[get(entry)]
+                except KeyError:
+                    pass
+            if not candidates:
+                continue
+            passed = {}  # predicate index -> result (for this token)
+            for t in candidates:
+                chain, i, key = targets[t]
+                if key is not None and key in first:
+                    continue
+                if seconds is not None:
+                    start = time.perf_counter()
+                for p in chain:
+                    try:
+                        result = passed[p]
+                    except KeyError:
+                        result = passed[p] = checks[p](entry)
+                    if not result:
+                        break
+                else:
+                    if key is None:
+                        counts[i] += 1
+                    else:
+                        first[key] = pos
+                if seconds is not None:
+                    elapsed = time.perf_counter() - start
+                    for j in ([i] if key is None else self.key_matchers[key]):
+                        seconds[j] += elapsed
+        if self.sentence_matchers:
+            for key in self.first_keys:
+                first.setdefault(key, -1)
+            features = UtteranceFeatures(sent, first)
+            for i, matcher in self.sentence_matchers:
+                if seconds is not None:
+                    start = time.perf_counter()
+                if matcher.match(sent, features):
+                    counts[i] = 1
+                if seconds is not None:
+                    seconds[i] += time.perf_counter() - start
+        return counts
+
+    def __str__(self):
+        lines = []
+        for matcher, chain in zip(self.matchers, self.chains):
+            lines.append('{}: {}'.format(matcher.label, ' -> '.join(
+                '{}={} ({:.3f})'.format(*self.keys[p], self.selectivity[p])
+                for p in chain)))
+        return '\n'.join(lines)
@@ -0,0 +1,47 @@
+# Helper functions for the results dictionaries:
+# {query -> {age -> [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par]}}
+
+from archive import strip_suffix  # Import from this repository.
+
+
+def update_results(results, matcher_str, age, counts):
+    try:  # Try to update an existing entry.
+        prev_counts = results[matcher_str][age]
+        results[matcher_str][age] = [sum(x) for x in zip(prev_counts, counts)]
+    except KeyError:  # New entry for results[matcher_str][age].
+        try:
+            results[matcher_str][age] = list(counts)
+        except KeyError:  # New entry for results[matcher_str].
+            results[matcher_str] = {age: list(counts)}
+    return results
+
+
+# Adds the counts for one file (a list of [n_occ_chi, n_utt_chi, n_occ_par,
+# n_utt_par] per matcher) to the results. Files without child utterances are
+# ignored.
+def add_counts(results, matchers, age, counts):
+    for matcher, matcher_counts in zip(matchers, counts):
+        if matcher_counts[1] > 0:  # n_utt_chi
+            results = update_results(results, matcher.label, age,
+                                     matcher_counts)
+    return results
+
+
+# The corpus of a file, i.e. the directory (or the archive, without its
+# suffix, see archive.py) in the data directory that contains it (None for
+# files directly in the data directory).
+def corpus_name(f):
+    if '/' not in f:
+        return None
+    return strip_suffix(f.split('/', 1)[0])
+
+
+# Like add_counts, but for the results of the file's corpus in a dictionary
+# {corpus -> results}.
+def add_corpus_counts(corpus_results, f, matchers, age, counts):
+    corpus = corpus_name(f)
+    if corpus is not None:
+        corpus_results[corpus] = add_counts(corpus_results.get(corpus, {}),
+                                            matchers, age, counts)
+    return corpus_results
+
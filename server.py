@@ -0,0 +1,290 @@
+# A local query server that keeps the corpus in memory as an inverted index
+# (see index.py), so that queries do not need to parse the corpus again and
+# several analysts can share one loaded corpus.
+#
+# The requests are JSON objects, sent with POST to http://HOST:PORT/PATH:
+#   /count        {"matchers": [definition, ...], "filter": {...}}
+#     -> {"results": {label -> {age -> [n_occ_chi, n_utt_chi, n_occ_par,
+#                                       n_utt_par]}}}
+#   /concordance  {"matcher": definition, "filter": {...}, "limit": N,
+#                  "width": N}
+#     -> {"total": N, "lines": [{"file": ..., "utterance": ..., "token": ...,
+#                                "speaker": ..., "age": ..., "left": ...,
+#                                "match": ..., "right": ..., "line": ...}]}
+# The matcher definitions are those of the matcher files (see
+# match.matcher_from_dict). The filter can contain "child", "parents",
+# "max_age" (like the command line options) and "corpora" (a list of corpus
+# names, see results.corpus_name); missing entries default to the settings
+# of the server. "max_age", "limit" and "width" must be non-negative integers
+# (otherwise the response is 400 Bad Request). GET /status returns the size of
+# the corpus and the cache statistics.
+#
+# The results are cached per matcher signature and filter in an LRU cache, so
+# that repeated queries (also with other labels) are answered immediately.
+
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+# Imports from this repository:
+from logsink import logger
+from match import SentenceMatcher, matcher_from_dict
+from results import corpus_name, update_results
+from tokentable import NO_AGE
+
+
+HOST = '127.0.0.1'
+PORT = 8040
+CACHE_SIZE = 1024  # cached (matcher, filter) results
+LIMIT = 100  # default number of concordance lines
+WIDTH = 8  # default number of context words on each side
+MAX_REQUEST_SIZE = 1 << 20  # bytes
+FILTER_KEYS = ('child', 'parents', 'max_age', 'corpora')
+
+
+# Raises a ValueError if the value of the request entry is not a non-negative
+# integer.
+def check_count(name, value):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError('{} must be a non-negative integer, not {}'
+                         .format(name, json.dumps(value)))
+
+
+# A thread-safe least-recently-used cache.
+class LRUCache:
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Raises a KeyError if the key is not in the cache.
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+# Answers the queries on a CorpusIndex (see index.py), with the given default
+# settings (see analyze.configure).
+class QueryEngine:
+
+    def __init__(self, index, child, parents, max_age, cache_size=CACHE_SIZE):
+        self.index = index
+        self.defaults = {'child': child, 'parents': list(parents),
+                         'max_age': max_age, 'corpora': None}
+        self.cache = LRUCache(cache_size)
+        self.file_corpora = [corpus_name(f) for f in index.files]
+
+    # The complete filter, with the defaults for the missing entries, and
+    # its (hashable) cache key.
+    def filter(self, query_filter=None):
+        query_filter = dict(query_filter or {})
+        unknown = set(query_filter) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError('Unknown filter entries: {}'
+                             .format(', '.join(sorted(unknown))))
+        complete = dict(self.defaults)
+        complete.update(query_filter)
+        check_count('max_age', complete['max_age'])
+        if isinstance(complete['parents'], str):
+            complete['parents'] = [complete['parents']]
+        if complete['corpora'] is not None:
+            complete['corpora'] = sorted(complete['corpora'])
+        return complete, json.dumps(complete, sort_keys=True)
+
+    # Whether each file of the index is selected by the filter (age known and
+    # at most max_age, and in one of the corpora).
+    def file_mask(self, query_filter):
+        ages = np.asarray(self.index.file_age)
+        mask = (ages != NO_AGE) & (ages <= query_filter['max_age'])
+        if query_filter['corpora'] is not None:
+            mask &= np.isin(np.array(self.file_corpora, dtype=object),
+                            query_filter['corpora'])
+        return mask
+
+    # Returns {label -> {age -> [n_occ_chi, n_utt_chi, n_occ_par,
+    # n_utt_par]}}, like the results of analyze.py, for the files selected
+    # by the filter.
+    def count(self, definitions, query_filter=None):
+        matchers = [matcher_from_dict(definition)
+                    for definition in definitions]
+        query_filter, filter_key = self.filter(query_filter)
+        matcher_results = {}  # signature -> {age -> counts}
+        missing = []
+        for matcher in matchers:
+            signature = matcher.signature()
+            try:
+                matcher_results[signature] = self.cache.get(
+                    ('count', signature, filter_key))
+            except KeyError:
+                if signature not in matcher_results:
+                    matcher_results[signature] = None
+                    missing.append(matcher)
+        if missing:
+            selected = self.file_mask(query_filter)
+            computed = {}  # index in missing -> {age -> counts}
+            for f, (age, counts) in enumerate(self.index.file_counts(
+                    missing, query_filter['child'], query_filter['parents'],
+                    query_filter['max_age'])):
+                if counts is None or not selected[f]:
+                    continue
+                for i, matcher_counts in enumerate(counts):
+                    if matcher_counts[1] > 0:  # n_utt_chi, see add_counts
+                        computed = update_results(computed, i, age,
+                                                  matcher_counts)
+            for i, matcher in enumerate(missing):
+                signature = matcher.signature()
+                matcher_results[signature] = computed.get(i, {})
+                self.cache.put(('count', signature, filter_key),
+                               matcher_results[signature])
+        return {matcher.label: matcher_results[matcher.signature()]
+                for matcher in matchers}
+
+    # Returns the total number of matches of the matcher in the utterances of
+    # the child and the parents in the files selected by the filter, and
+    # concordance lines (keyword in context) for the first limit matches.
+    # For sentence-level matchers, the keyword is the first token matched by
+    # the token matcher in the utterance.
+    def concordance(self, definition, query_filter=None, limit=LIMIT,
+                    width=WIDTH):
+        check_count('limit', limit)
+        check_count('width', width)
+        matcher = matcher_from_dict(definition)
+        query_filter, filter_key = self.filter(query_filter)
+        key = ('concordance', matcher.signature(), filter_key, limit, width)
+        try:
+            return self.cache.get(key)
+        except KeyError:
+            pass
+        index = self.index
+        if isinstance(matcher, SentenceMatcher):
+            matched = index.utterance_counts(matcher) > 0
+            token_ids = index.match_ids(matcher.matcher)
+            # The first match in each utterance.
+            utts, first = np.unique(index.token_utt[token_ids],
+                                    return_index=True)
+            token_ids = token_ids[first][matched[utts]]
+        else:
+            token_ids = index.match_ids(matcher)
+        utts = index.token_utt[token_ids]
+        speakers = [query_filter['child']] + query_filter['parents']
+        keep = (np.isin(index.utt_speaker[utts], index.codes(speakers))
+                & self.file_mask(query_filter)[index.utt_file[utts]])
+        token_ids = token_ids[keep]
+        shown = token_ids[:limit]
+        lines = []
+        forms = index.columns['form']
+        for token, (f, u, t, speaker) in zip(shown.tolist(),
+                                             index.locations(shown)):
+            utt = index.token_utt[token]
+            start = int(index.utt_offsets[utt])
+            end = int(index.utt_offsets[utt + 1])
+            left = ' '.join(index.strings[code] for code
+                            in forms[max(start, token - width):token])
+            match = index.strings[forms[token]]
+            right = ' '.join(index.strings[code] for code
+                             in forms[token + 1:min(end, token + 1 + width)])
+            lines.append({'file': f, 'utterance': u, 'token': t,
+                          'speaker': speaker,
+                          'age': int(index.file_age[index.utt_file[utt]]),
+                          'left': left, 'match': match, 'right': right,
+                          'line': '{} : {}'.format(speaker, ' '.join(
+                              part for part in (left, '[' + match + ']',
+                                                right) if part))})
+        result = {'total': len(token_ids), 'lines': lines}
+        self.cache.put(key, result)
+        return result
+
+    def status(self):
+        return {'files': len(self.index.files), 'tokens': len(self.index),
+                'utterances': self.index.n_utterances(),
+                'defaults': self.defaults, 'cache': self.cache.stats()}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.server.engine.status())
+        else:
+            self.send_json(404, {'error': 'Unknown path: {}'
+                                          .format(self.path)})
+
+    def do_POST(self):
+        engine = self.server.engine
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_SIZE:
+                raise ValueError('The request is too large.')
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/count':
+                response = {'results': engine.count(
+                    request['matchers'], request.get('filter'))}
+            elif self.path == '/concordance':
+                response = engine.concordance(
+                    request['matcher'], request.get('filter'),
+                    request.get('limit', LIMIT), request.get('width', WIDTH))
+            else:
+                self.send_json(404, {'error': 'Unknown path: {}'
+                                              .format(self.path)})
+                return
+        except KeyError as e:
+            self.send_json(400, {'error': 'Missing entry: {}'.format(e)})
+            return
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, response)
+
+    def send_json(self, status, response):
+        body = json.dumps(response).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info('%s %s', self.address_string(), format % args)
+
+
+class QueryServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, engine, host=HOST, port=PORT):
+        ThreadingHTTPServer.__init__(self, (host, port), QueryHandler)
+        self.engine = engine
+
+
+# Serves the queries until the process is interrupted.
+def serve(engine, host=HOST, port=PORT):
+    with QueryServer(engine, host, port) as server:
+        logger.info('Serving %d files on http://%s:%d/',
+                    len(engine.index.files), *server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
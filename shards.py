@@ -0,0 +1,148 @@
+# Result files that can be written by independent runs (shards) and merged.
+#
+# The files of the corpus are split into N shards by a hash of their names
+# (see shard_files), so that each shard can be counted on a different machine
+# and a failed shard can be run again on its own. Each run writes a versioned
+# JSON file with the counts per file, together with their provenance:
+# {'format': ..., 'version': ...,
+#  'settings': {child, parents, max_age, parser_version},
+#  'n_shards': N, 'shards': [indices of the shards in the file],
+#  'matchers': [{'label': ..., 'signature': ..., 'definition': ...}],
+#  'files': {file -> {'sha1': ..., 'age': ..., 'name': name of the child,
+#                     'counts': [[n_occ_chi, n_utt_chi, n_occ_par,
+#                                 n_utt_par] per matcher] or None}}}
+# Merging any number of such files (in any order) gives the same file as a
+# single run over all shards, and the results dictionary, the results of
+# each corpus and the results cube are computed from the counts per file in
+# the same order as a run over all files.
+
+import hashlib
+import json
+import os
+# Imports from this repository:
+from match import matcher_from_dict, matcher_to_dict
+from results import add_corpus_counts, add_counts
+
+
+SHARD_FORMAT = 'childes-morpheme-counts'
+SHARD_VERSION = 2
+
+
+# The files of the given shard (0 <= shard < n_shards). A file always belongs
+# to the same shard, no matter which other files there are.
+def shard_files(files, shard, n_shards):
+    return [f for f in files
+            if int(hashlib.sha1(f.encode('utf8')).hexdigest(), 16)
+            % n_shards == shard]
+
+
+# Creates the result file of a shard from the (file, age, counts) tuples of
+# its files (see analyze.count_file), the content hashes of the files and the
+# names of the children (see analyze.select_files).
+def build_shard(file_counts, hashes, names, matchers, settings, shard=0,
+                n_shards=1):
+    return {'format': SHARD_FORMAT, 'version': SHARD_VERSION,
+            'settings': settings, 'n_shards': n_shards, 'shards': [shard],
+            'matchers': [{'label': matcher.label,
+                          'signature': matcher.signature(),
+                          'definition': matcher_to_dict(matcher)}
+                         for matcher in matchers],
+            'files': {f: {'sha1': hashes[f], 'age': age,
+                          'name': names.get(f), 'counts': counts}
+                      for f, age, counts in file_counts}}
+
+
+def save_shard(filename, shard):
+    # Write to a temporary file first, so that a crashed run never leaves a
+    # partial result file behind.
+    tmp_path = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(shard, f, sort_keys=True)
+    os.replace(tmp_path, filename)
+
+
+def load_shard(filename):
+    with open(filename, encoding='utf8') as f:
+        shard = json.load(f)
+    if not isinstance(shard, dict) or shard.get('format') != SHARD_FORMAT:
+        raise ValueError('{} is not a result file.'.format(filename))
+    if shard['version'] != SHARD_VERSION:
+        raise ValueError('{} has version {} (expected {}).'
+                         .format(filename, shard['version'], SHARD_VERSION))
+    return shard
+
+
+# Raises a ValueError if the result file contains files that do not belong
+# to any of its shards.
+def check_shard_files(shard):
+    n_shards = shard['n_shards']
+    for f in shard['files']:
+        if not any(shard_files([f], i, n_shards) for i in shard['shards']):
+            raise ValueError('{} does not belong to shard(s) {} of {}.'.format(
+                f, ', '.join(str(i) for i in shard['shards']), n_shards))
+
+
+# Merges result files that were created with the same settings and matchers.
+# Raises a ValueError if they are not compatible, if a shard occurs twice, if
+# a file is not in one of the shards of its result file or if a file has
+# different counts in two of them.
+def merge_shards(shards):
+    if not shards:
+        raise ValueError('No result files to merge.')
+    merged = dict(shards[0], shards=[], files={})
+    for shard in shards:
+        for key in ('settings', 'n_shards', 'matchers'):
+            if shard[key] != merged[key]:
+                raise ValueError('The result files have different {}.'
+                                 .format(key))
+        check_shard_files(shard)
+        duplicates = set(shard['shards']) & set(merged['shards'])
+        if duplicates:
+            raise ValueError('Shard(s) {} occur more than once.'.format(
+                ', '.join(str(i) for i in sorted(duplicates))))
+        merged['shards'] = sorted(merged['shards'] + shard['shards'])
+        for f, entry in shard['files'].items():
+            try:
+                if merged['files'][f] != entry:
+                    raise ValueError('The result files have different counts '
+                                     'for {}.'.format(f))
+            except KeyError:
+                merged['files'][f] = entry
+    merged['files'] = {f: merged['files'][f] for f in sorted(merged['files'])}
+    return merged
+
+
+# The shards that are not in the result file.
+def missing_shards(shard):
+    return sorted(set(range(shard['n_shards'])) - set(shard['shards']))
+
+
+def shard_matchers(shard):
+    return [matcher_from_dict(matcher['definition'])
+            for matcher in shard['matchers']]
+
+
+# The (file, age, counts) tuples, sorted by file (like the files of a run).
+def shard_file_counts(shard):
+    return [(f, entry['age'], entry['counts'])
+            for f, entry in sorted(shard['files'].items())]
+
+
+# The names of the children {file -> name} (see cube.child_name).
+def shard_names(shard):
+    return {f: entry['name'] for f, entry in shard['files'].items()}
+
+
+# Returns the results dictionary of the result file. If a corpus_results
+# dictionary is given, the results of each corpus are also added to it (see
+# results.add_corpus_counts).
+def shard_results(shard, corpus_results=None):
+    matchers = shard_matchers(shard)
+    results = {}
+    for f, age, counts in shard_file_counts(shard):
+        if counts is None:
+            continue
+        results = add_counts(results, matchers, age, counts)
+        if corpus_results is not None:
+            add_corpus_counts(corpus_results, f, matchers, age, counts)
+    return results
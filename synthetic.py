@@ -0,0 +1,251 @@
+# A deterministic generator for synthetic CHILDES transcripts in the TalkBank
+# XML format, for benchmarking the corpus reader and the matchers at scale.
+#
+# The transcripts have the same structure as the CHILDES XML files that
+# CHILDESMorphFileReader reads (<u>, <w>, <mor>, <mw>, <pos>, <stem>, <mk>,
+# <mor-post>, <gra>, <replacement>, <g>, <t>), and the lexicon below covers
+# all of the features in the default matchers (matchers.json). The mix of
+# word types and the number of children, sessions, utterances and speakers
+# can be configured.
+
+import argparse
+import os
+import random
+from xml.sax.saxutils import escape
+
+
+NS = 'http://www.talkbank.org/ns/talkbank'
+
+# Word types:
+# (form, c, s, stem, mk_type, mk, relation, clitic)
+# where the clitic (mor-post) is None or (c, stem, mk_type, mk, relation).
+LEXICON = {
+    'plain': [
+        ('the', 'det', 'art', 'the', None, None, 'DET', None),
+        ('a', 'det', 'art', 'a', None, None, 'DET', None),
+        ('an', 'det', 'art', 'a', None, None, 'DET', None),
+        ('in', 'prep', None, 'in', None, None, 'JCT', None),
+        ('on', 'prep', None, 'on', None, None, 'JCT', None),
+        ('dog', 'n', None, 'dog', None, None, 'OBJ', None),
+        ('ball', 'n', None, 'ball', None, None, 'OBJ', None),
+        ('Mommy', 'n', 'prop', 'Mommy', None, None, 'VOC', None),
+        ('you', 'pro', 'per', 'you', None, None, 'SUBJ', None),
+        ('that', 'pro', 'dem', 'that', None, None, 'SUBJ', None),
+        ('what', 'pro', 'int', 'what', None, None, 'OBJ', None),
+        ('go', 'v', None, 'go', None, None, 'ROOT', None),
+        ('want', 'v', None, 'want', None, None, 'ROOT', None),
+        ('not', 'neg', None, 'not', None, None, 'NEG', None),
+        ('there', 'adv', None, 'there', None, None, 'JCT', None),
+    ],
+    'affix': [
+        ('dogs', 'n', None, 'dog', 'sfx', 'PL', 'OBJ', None),
+        ('balls', 'n', None, 'ball', 'sfx', 'PL', 'SUBJ', None),
+        ('walked', 'v', None, 'walk', 'sfx', 'PAST', 'ROOT', None),
+        ('jumped', 'v', None, 'jump', 'sfx', 'PAST', 'ROOT', None),
+        ('walks', 'v', None, 'walk', 'sfx', '3S', 'ROOT', None),
+        ('wants', 'v', None, 'want', 'sfx', '3S', 'ROOT', None),
+        ('going', 'part', None, 'go', 'sfx', 'PRESP', 'ROOT', None),
+        ('making', 'part', None, 'make', 'sfx', 'PRESP', 'XMOD', None),
+    ],
+    'fusion': [
+        ('went', 'v', None, 'go', 'sfxf', 'PAST', 'ROOT', None),
+        ('did', 'mod', None, 'do', 'sfxf', 'PAST', 'AUX', None),
+        ('has', 'v', None, 'have', 'sfxf', '3S', 'ROOT', None),
+        ('does', 'v', None, 'do', 'sfxf', '3S', 'ROOT', None),
+        ('feet', 'n', None, 'foot', 'sfxf', 'PL', 'OBJ', None),
+        ('is', 'cop', None, 'be', 'sfxf', '3S', 'ROOT', None),
+        ('was', 'cop', None, 'be', 'sfxf', 'PAST', 'COMP', None),
+        ('is', 'aux', None, 'be', 'sfxf', '3S', 'AUX', None),
+        ('are', 'aux', None, 'be', 'sfxf', 'PRES', 'AUX', None),
+    ],
+    'clitic': [
+        ("it's", 'pro', 'per', 'it', None, None, 'SUBJ',
+         ('cop', 'be', 'sfxf', '3S', 'ROOT')),
+        ("that's", 'pro', 'dem', 'that', None, None, 'SUBJ',
+         ('cop', 'be', 'sfxf', '3S', 'COMP')),
+        ("he's", 'pro', 'sub', 'he', None, None, 'SUBJ',
+         ('aux', 'be', 'sfxf', '3S', 'AUX')),
+        ("I'm", 'pro', 'sub', 'I', None, None, 'SUBJ',
+         ('aux', 'be', 'sfxf', '1S', 'AUX')),
+        ("dog's", 'n', None, 'dog', None, None, 'MOD',
+         ('aux', 'be', 'sfxf', '3S', 'POSS')),
+        ("Mommy's", 'n', 'prop', 'Mommy', None, None, 'MOD',
+         ('aux', 'be', 'sfxf', '3S', 'POSS')),
+        ("don't", 'mod', None, 'do', None, None, 'AUX',
+         ('neg', 'not', None, None, 'NEG')),
+    ],
+}
+# Non-standard forms and their (standard) replacements.
+REPLACEMENTS = [('dat', 'that', 'pro', 'dem'), ('dis', 'this', 'pro', 'dem'),
+                ('foots', 'feet', 'n', None)]
+# The default morphology mix: the probability of each word type.
+MIX = {'plain': 0.55, 'affix': 0.15, 'fusion': 0.15, 'clitic': 0.1,
+       'replacement': 0.05}
+SPEAKERS = ['CHI', 'MOT', 'FAT', 'INV']
+# The probability of each speaker.
+SPEAKER_WEIGHTS = [0.45, 0.3, 0.15, 0.1]
+
+
+def pos_xml(c, s):
+    if s:
+        return '<pos><c>{}</c><s>{}</s></pos>'.format(c, s)
+    return '<pos><c>{}</c></pos>'.format(c)
+
+
+def mw_xml(c, s, stem, mk_type, mk):
+    xml = '<mw>{}<stem>{}</stem>'.format(pos_xml(c, s), escape(stem))
+    if mk:
+        xml += '<mk type="{}">{}</mk>'.format(mk_type, mk)
+    return xml + '</mw>'
+
+
+def gra_xml(index, head, relation):
+    return '<gra type="gra" index="{}" head="{}" relation="{}"/>' \
+           .format(index, head, relation)
+
+
+# Returns the XML for the word and the index of the next word.
+def word_xml(entry, index, head):
+    form, c, s, stem, mk_type, mk, relation, clitic = entry
+    xml = '<w>{}<mor type="mor">{}{}'.format(
+        escape(form), mw_xml(c, s, stem, mk_type, mk),
+        gra_xml(index, head, relation))
+    index += 1
+    if clitic:
+        post_c, post_stem, post_mk_type, post_mk, post_relation = clitic
+        xml += '<mor-post>{}{}</mor-post>'.format(
+            mw_xml(post_c, None, post_stem, post_mk_type, post_mk),
+            gra_xml(index, index - 1, post_relation))
+        index += 1
+    return xml + '</mor></w>', index
+
+
+def replacement_xml(rnd, index, head):
+    form, replacement, c, s = rnd.choice(REPLACEMENTS)
+    xml = '<w>{}<replacement><w>{}<mor type="mor">{}{}</mor></w>' \
+          '</replacement></w>'.format(form, replacement,
+                                      mw_xml(c, s, replacement, None, None),
+                                      gra_xml(index, head, 'SUBJ'))
+    return xml, index + 1
+
+
+def utterance_xml(rnd, uid, speaker, n_words, mix):
+    word_types = list(mix)
+    weights = [mix[word_type] for word_type in word_types]
+    words = []
+    index = 1
+    for _ in range(n_words):
+        head = rnd.randint(0, n_words)
+        word_type = rnd.choices(word_types, weights)[0]
+        if word_type == 'replacement':
+            xml, index = replacement_xml(rnd, index, head)
+        else:
+            xml, index = word_xml(rnd.choice(LEXICON[word_type]), index,
+                                  head)
+        if rnd.random() < 0.05:  # Some words are in groups.
+            xml = '<g>{}</g>'.format(xml)
+        words.append(xml)
+    if rnd.random() < 0.7:  # Final punctuation.
+        words.append('<t type="p"><mor type="mor"><mt type="p"/>{}</mor></t>'
+                     .format(gra_xml(index, 1, 'PUNCT')))
+    return '<u who="{}" uID="u{}">\n{}\n</u>'.format(speaker, uid,
+                                                    '\n'.join(words))
+
+
+def age_str(days):
+    years, days = divmod(days, 365)
+    months, days = divmod(days, 30)
+    return 'P{}Y{:02d}M{:02d}D'.format(years, min(months, 11), days)
+
+
+def session_xml(rnd, child, age_days, n_utterances, speakers, mix,
+                max_words=10):
+    participants = ['<participant id="{}" role="{}"{} language="eng"/>'
+                    .format(speaker,
+                            'Target_Child' if speaker == 'CHI' else 'Other',
+                            ' name="{}" age="{}"'.format(child,
+                                                         age_str(age_days))
+                            if speaker == 'CHI' else '')
+                    for speaker in speakers]
+    weights = [SPEAKER_WEIGHTS[SPEAKERS.index(speaker)]
+               if speaker in SPEAKERS else 0.1 for speaker in speakers]
+    utterances = [utterance_xml(rnd, i, rnd.choices(speakers, weights)[0],
+                                rnd.randint(1, max_words), mix)
+                  for i in range(n_utterances)]
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' \
+           '<CHAT xmlns="{}" Version="2.7.1" Lang="eng" Corpus="Synthetic">' \
+           '\n<Participants>\n{}\n</Participants>\n{}\n</CHAT>\n' \
+           .format(NS, '\n'.join(participants), '\n'.join(utterances))
+
+
+# Writes the synthetic corpus to path/<child>/<session>.xml and returns the
+# file IDs (relative to path). The sessions of each child are two weeks
+# apart, starting at an age between 18 and 30 months. The same arguments
+# always produce the same corpus.
+def generate_corpus(path, children=4, sessions=20, utterances=500,
+                    speakers=tuple(SPEAKERS), mix=None, seed=0):
+    rnd = random.Random(seed)
+    if mix is None:
+        mix = MIX
+    fileids = []
+    for i in range(children):
+        child = 'Child{}'.format(i + 1)
+        os.makedirs(os.path.join(path, child), exist_ok=True)
+        age_days = rnd.randint(18 * 30, 30 * 30)
+        for j in range(sessions):
+            fileid = '{}/{:03d}.xml'.format(child, j + 1)
+            with open(os.path.join(path, fileid), 'w', encoding='utf8') as f:
+                f.write(session_xml(rnd, child, age_days, utterances,
+                                    list(speakers), mix))
+            fileids.append(fileid)
+            age_days += 14
+    return fileids
+
+
+# Parses a TYPE=WEIGHT command line argument for the morphology mix (see
+# MIX), e.g. 'clitic=0.3'.
+def mix_item(arg):
+    word_type, _, weight = arg.partition('=')
+    if word_type not in MIX:
+        raise argparse.ArgumentTypeError(
+            'unknown word type: {} (use {})'.format(word_type,
+                                                    ', '.join(MIX)))
+    try:
+        weight = float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid weight: {}'.format(arg))
+    if weight <= 0:
+        raise argparse.ArgumentTypeError('the weight must be positive: {}'
+                                         .format(arg))
+    return word_type, weight
+
+
+# Adds the --speakers and --mix options to a command line parser. The word
+# types that are not given in --mix do not occur.
+def add_corpus_arguments(parser):
+    parser.add_argument('--speakers', metavar='CODE', nargs='+',
+                        default=SPEAKERS,
+                        help='the speaker codes (default: {})'
+                             .format(' '.join(SPEAKERS)))
+    parser.add_argument('--mix', metavar='TYPE=WEIGHT', nargs='+',
+                        type=mix_item, default=None,
+                        help='the relative frequency of each word type '
+                             '(default: {})'.format(' '.join(
+                                 '{}={}'.format(word_type, weight)
+                                 for word_type, weight in MIX.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic CHILDES corpus.')
+    parser.add_argument('path')
+    parser.add_argument('--children', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--utterances', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    print(len(generate_corpus(args.path, args.children, args.sessions,
+                              args.utterances, args.speakers,
+                              dict(args.mix) if args.mix else None,
+                              args.seed)), 'files')
@@ -0,0 +1,174 @@
+# Parity tests for CHILDESMorphFileReader (run with python -m pytest): all XML
+# parser backends and the whole-tree, streaming and cached modes must return
+# exactly the same Words as the original reader, both for data/test.xml and
+# for a small synthetic corpus (see synthetic.py).
+
+import os
+from xml.etree import ElementTree
+import pytest
+# Imports from this repository:
+from corpusreader import BACKENDS, NS, CHILDESMorphFileReader
+from synthetic import generate_corpus
+from word import Word
+
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+PARSERS = ['etree', 'lxml']
+
+
+# The utterances of the file as (speaker, [str(word), ...]) tuples, extracted
+# like the original version of CHILDESMorphFileReader._get_morph_words did
+# (one search per field and word, with the standard library's parser).
+def original_morph_sents(path, strip_space=True):
+    results = []
+    for xmlsent in ElementTree.parse(path).getroot().findall('.//{%s}u' % NS):
+        sents = []
+        skip = False
+        for xmlword in xmlsent.findall('.//{%s}w' % NS):
+            if skip:
+                skip = False
+                sents[-1].replacement = xmlword.text
+                continue
+            if xmlword.find('.//{%s}replacement' % NS):
+                skip = True
+            suffix_tag = None
+            word = xmlword.text if xmlword.text else ''
+            if strip_space:
+                word = word.strip()
+            infl, stem = '', ''
+            try:
+                stem = xmlword.find('.//{%s}stem' % NS).text
+            except AttributeError:
+                pass
+            try:
+                xmlinfl = xmlword.find('.//{%s}mor/{%s}mw/{%s}mk'
+                                       % (NS, NS, NS))
+                infl_type = ''
+                try:
+                    infl_type = xmlinfl.attrib['type']
+                except ValueError:
+                    pass
+                infl = xmlinfl.text
+            except (AttributeError, KeyError):
+                pass
+            try:
+                suffix_stem = xmlword.find(
+                    './/{%s}mor/{%s}mor-post/{%s}mw/{%s}stem'
+                    % (NS, NS, NS, NS)).text
+            except AttributeError:
+                suffix_stem = ''
+            if suffix_stem:
+                word += '~' + suffix_stem
+            try:
+                xmlpos = xmlword.findall('.//{%s}c' % NS)
+                xmlpos2 = xmlword.findall('.//{%s}s' % NS)
+                if xmlpos2 != []:
+                    tag = xmlpos[0].text + ':' + xmlpos2[0].text
+                else:
+                    tag = xmlpos[0].text
+            except (AttributeError, IndexError):
+                tag = ''
+            try:
+                xmlsuffixpos = xmlword.findall(
+                    './/{%s}mor/{%s}mor-post/{%s}mw/{%s}pos/{%s}c'
+                    % (NS, NS, NS, NS, NS))
+                xmlsuffixpos2 = xmlword.findall(
+                    './/{%s}mor/{%s}mor-post/{%s}mw/{%s}pos/{%s}s'
+                    % (NS, NS, NS, NS, NS))
+                if xmlsuffixpos2:
+                    suffix_tag = (xmlsuffixpos[0].text + ':'
+                                  + xmlsuffixpos2[0].text)
+                else:
+                    suffix_tag = xmlsuffixpos[0].text
+            except (AttributeError, IndexError, TypeError):
+                pass
+            if suffix_tag:
+                tag += '~' + suffix_tag
+            word = Word(word, tag, stem, infl, infl_type)
+            for xmlrel in xmlword.findall('.//{%s}mor/{%s}gra' % (NS, NS)):
+                word.rel = xmlrel.get('relation')
+            for xmlpost_rel in xmlword.findall(
+                    './/{%s}mor/{%s}mor-post/{%s}gra' % (NS, NS, NS)):
+                word.post_rel = xmlpost_rel.get('relation')
+            sents.append(word)
+        results.append((xmlsent.get('who'), [str(word) for word in sents]))
+    return results
+
+
+def as_strings(utterances):
+    return [(who, [str(word) for word in sent]) for who, sent in utterances]
+
+
+# (root directory, file ids) of the corpora that are tested.
+@pytest.fixture(scope='module', params=['test.xml', 'synthetic'])
+def corpus(request, tmp_path_factory):
+    if request.param == 'test.xml':
+        return DATA_PATH, ['test.xml']
+    root = str(tmp_path_factory.mktemp('synthetic'))
+    return root, generate_corpus(root, children=2, sessions=2,
+                                 utterances=100, seed=0)
+
+
+@pytest.fixture(scope='module')
+def expected(corpus):
+    root, fileids = corpus
+    return [utterance for fileid in fileids
+            for utterance in original_morph_sents(os.path.join(root,
+                                                               fileid))]
+
+
+def reader(corpus, parser, **kwargs):
+    if parser not in BACKENDS:
+        pytest.skip('The {} parser is not installed.'.format(parser))
+    return CHILDESMorphFileReader(*corpus, parser=parser, **kwargs)
+
+
+def test_corpus_is_not_empty(expected):
+    assert any(words for _, words in expected)
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_tree_matches_original(corpus, expected, parser):
+    words = reader(corpus, parser).speaker_morph_sents()
+    assert as_strings(words) == expected
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_tagged_sents_match_original(corpus, expected, parser):
+    sents = reader(corpus, parser).tagged_morph_sents()
+    assert [[str(word) for word in sent] for sent in sents] \
+        == [words for _, words in expected]
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_streaming_matches_original(corpus, expected, parser):
+    words = reader(corpus, parser).iter_morph_sents(keep_speaker=True)
+    assert as_strings(words) == expected
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_cached_matches_original(corpus, expected, parser, tmp_path):
+    # The first reader fills the cache, the second one only reads from it.
+    for _ in range(2):
+        words = reader(corpus, parser, cache_dir=str(tmp_path)) \
+            .iter_morph_sents(keep_speaker=True)
+        assert as_strings(words) == expected
+    assert os.listdir(tmp_path)
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_speaker_selection(corpus, expected, parser):
+    words = reader(corpus, parser).iter_morph_sents(speaker=['CHI', 'MOT'],
+                                                    keep_speaker=True)
+    assert as_strings(words) == [(who, sent) for who, sent in expected
+                                 if who in ('CHI', 'MOT')]
+
+
+def test_parsers_identical(corpus):
+    if 'lxml' not in BACKENDS:
+        pytest.skip('The lxml parser is not installed.')
+    for mode in ('speaker_morph_sents', 'iter_morph_sents'):
+        kwargs = {'keep_speaker': True} if mode == 'iter_morph_sents' else {}
+        assert as_strings(getattr(reader(corpus, 'lxml'), mode)(**kwargs)) \
+            == as_strings(getattr(reader(corpus, 'etree'), mode)(**kwargs))
+
@@ -0,0 +1,282 @@
+# A columnar representation of a (morphologically annotated) corpus.
+#
+# Instead of one Word object per token, the corpus is stored as a table with
+# one NumPy array per Word attribute. All strings are interned in a single
+# vocabulary, so that each column only contains integer codes. The
+# utterances are given by offsets into the token columns, together with the
+# speaker (again as a string code) and the file of each utterance. The ages
+# of the children are stored per file (-1 if unknown).
+#
+# This allows evaluating matchers as vectorized boolean masks over the whole
+# corpus instead of calling Matcher.match for every single token.
+
+import array
+import json
+import os
+import numpy as np
+# Imports from this repository:
+from match import SentenceMatcher
+from results import add_corpus_counts, add_counts
+from word import Word
+
+
+FIELDS = Word.__slots__
+NO_AGE = -1
+
+
+class TokenTable:
+
+    def __init__(self, strings, columns, utt_offsets, utt_speaker, utt_file,
+                 files, file_age):
+        self.strings = strings
+        self.string_ids = {string: i for i, string in enumerate(strings)}
+        self.columns = columns  # field -> int32 array (one code per token)
+        self.utt_offsets = utt_offsets  # int64 array of length n_utt + 1
+        self.utt_speaker = utt_speaker  # int32 array (string codes)
+        self.utt_file = utt_file  # int32 array (indices into self.files)
+        self.files = files
+        self.file_age = file_age  # int32 array (in months, or NO_AGE)
+        self._token_utt = None
+
+    # The utterance index of each token (only created when it is needed).
+    @property
+    def token_utt(self):
+        if self._token_utt is None:
+            self._token_utt = np.repeat(np.arange(len(self.utt_speaker),
+                                                  dtype=np.int32),
+                                        np.diff(self.utt_offsets))
+        return self._token_utt
+
+    # If the ages of the files are already known, they can be passed as a
+    # dictionary (see analyze.select_files).
+    @classmethod
+    def from_corpus(cls, corpus, strip_space=True, ages=None):
+        strings = []
+        string_ids = {}
+
+        def intern(string):
+            try:
+                return string_ids[string]
+            except KeyError:
+                string_ids[string] = len(strings)
+                strings.append(string)
+                return string_ids[string]
+
+        columns = {field: array.array('i') for field in FIELDS}
+        utt_offsets = array.array('q', [0])
+        utt_speaker = array.array('i')
+        utt_file = array.array('i')
+        files = []
+        file_age = array.array('i')
+        for fileid in corpus.fileids():
+            if ages is not None and fileid in ages:
+                age = ages[fileid]
+            else:
+                age = corpus.age(fileid, month=True)[0]
+            file_age.append(NO_AGE if age is None else age)
+            for speaker, sent in corpus.iter_morph_sents(
+                    fileid, strip_space=strip_space, keep_speaker=True):
+                utt_speaker.append(intern(speaker))
+                utt_file.append(len(files))
+                for word in sent:
+                    for field in FIELDS:
+                        columns[field].append(intern(getattr(word, field)))
+                utt_offsets.append(utt_offsets[-1] + len(sent))
+            files.append(fileid)
+        return cls(strings,
+                   {field: np.array(col, dtype=np.int32)
+                    for field, col in columns.items()},
+                   np.array(utt_offsets, dtype=np.int64),
+                   np.array(utt_speaker, dtype=np.int32),
+                   np.array(utt_file, dtype=np.int32),
+                   files,
+                   np.array(file_age, dtype=np.int32))
+
+    def __len__(self):
+        return int(self.utt_offsets[-1])
+
+    def n_utterances(self):
+        return len(self.utt_speaker)
+
+    # --- Saving/loading: one .npy file per array, plus the string tables.
+
+    # The provenance of the table (see analyze.table_provenance) is saved
+    # with the string tables, so that a stored table can be checked against
+    # the files before it is used.
+    def save(self, path, provenance=None):
+        os.makedirs(path, exist_ok=True)
+        for field, col in self.columns.items():
+            np.save(os.path.join(path, field + '.npy'), col)
+        for name in ('utt_offsets', 'utt_speaker', 'utt_file', 'file_age'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'strings.json'), 'w',
+                  encoding='utf8') as f:
+            json.dump({'strings': self.strings, 'files': self.files,
+                       'provenance': provenance}, f)
+
+    # With mmap, the arrays are memory-mapped (read-only) instead of being
+    # read into memory.
+    @classmethod
+    def load(cls, path, mmap=False):
+        return cls(*cls.load_args(path, mmap))
+
+    # The constructor arguments for the table stored in the given directory.
+    @staticmethod
+    def load_args(path, mmap=False):
+        with open(os.path.join(path, 'strings.json'), encoding='utf8') as f:
+            tables = json.load(f)
+
+        def load_array(name):
+            return np.load(os.path.join(path, name + '.npy'),
+                           mmap_mode='r' if mmap else None)
+
+        return (tables['strings'],
+                {field: load_array(field) for field in FIELDS},
+                load_array('utt_offsets'), load_array('utt_speaker'),
+                load_array('utt_file'), tables['files'],
+                load_array('file_age'))
+
+    # The provenance saved with the table in the given directory (None if the
+    # table was saved without it).
+    @staticmethod
+    def load_provenance(path):
+        with open(os.path.join(path, 'strings.json'), encoding='utf8') as f:
+            return json.load(f).get('provenance')
+
+    def args(self):
+        return (self.strings, self.columns, self.utt_offsets,
+                self.utt_speaker, self.utt_file, self.files, self.file_age)
+
+    # --- Matching.
+
+    # Codes of the given string(s), ignoring strings that do not occur in
+    # the corpus.
+    def codes(self, values):
+        if isinstance(values, str):
+            values = [values]
+        return np.array([self.string_ids[val] for val in values
+                         if val in self.string_ids], dtype=np.int32)
+
+    # Applies a predicate to each string in the vocabulary.
+    def vocab_mask(self, predicate):
+        return np.array([predicate(string) for string in self.strings],
+                        dtype=bool)
+
+    def field_isin(self, field, values):
+        return np.isin(self.columns[field], self.codes(values))
+
+    # The vectorized equivalent of Matcher.match.
+    def match_mask(self, matcher):
+        no_replacement = self.vocab_mask(lambda string: not string)
+        mask = no_replacement[self.columns['replacement']]
+        for field in ('form', 'infl', 'rel', 'post_rel', 'sfx_tag', 'tag',
+                      'stem'):
+            if getattr(matcher, field):
+                mask &= self.field_isin(field, getattr(matcher, field))
+        if matcher.infl_affix:
+            mask &= self.field_isin('infl_type', 'sfx')
+        if matcher.infl_fusion:
+            mask &= self.field_isin('infl_type', 'sfxf')
+        if matcher.suffix:
+            suffix = matcher.suffix
+            if not isinstance(suffix, str):
+                suffix = tuple(suffix)
+            ends = self.vocab_mask(lambda string: string is not None
+                                   and string.endswith(suffix))
+            mask &= ends[self.columns['form']]
+        return mask
+
+    # The (sorted) indices of the tokens matched by the matcher.
+    def match_ids(self, matcher):
+        return np.flatnonzero(self.match_mask(matcher))
+
+    # The number of occurrences per utterance.
+    def utterance_counts(self, matcher):
+        if isinstance(matcher, SentenceMatcher):
+            try:
+                match = getattr(self, 'match_' + matcher.condition)
+            except AttributeError:
+                raise ValueError('There is no vectorized implementation of '
+                                 'the condition {}'.format(matcher.condition))
+            return match(matcher.matcher).astype(np.int64)
+        return np.bincount(self.token_utt[self.match_ids(matcher)],
+                           minlength=self.n_utterances())
+
+    # The vectorized equivalent of SentenceMatcher.match_uncontractible.
+    def match_uncontractible(self, matcher):
+        matches = np.zeros(self.n_utterances(), dtype=bool)
+        token_ids = self.match_ids(matcher)
+        # The first match in each utterance.
+        utts, first = np.unique(self.token_utt[token_ids], return_index=True)
+        token_ids = token_ids[first]
+        negated_or_past = (
+            np.isin(self.columns['sfx_tag'][token_ids], self.codes('neg'))
+            | np.isin(self.columns['infl'][token_ids], self.codes('PAST')))
+        # Sentence-initial/final copula/aux.
+        position = token_ids - self.utt_offsets[utts]
+        sent_last = self.utt_offsets[utts + 1] - self.utt_offsets[utts] - 1
+        last_is_punct = np.isin(
+            self.columns['tag'][self.utt_offsets[utts + 1] - 1],
+            self.codes('PUNCT'))
+        matches[utts] = (negated_or_past | (position == 0)
+                         | (position == sent_last)
+                         | ((position == sent_last - 1) & last_is_punct))
+        return matches
+
+    # Returns the (age, counts) tuple of each file, like analyze.count_file:
+    # counts is the list of [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par] per
+    # matcher, or None if the file is skipped (no age or older than max_age).
+    def file_counts(self, matchers, child, parents, max_age):
+        n_files = len(self.files)
+        is_chi = np.isin(self.utt_speaker, self.codes(child))
+        is_par = np.isin(self.utt_speaker, self.codes(parents))
+        n_utt_chi = np.bincount(self.utt_file[is_chi], minlength=n_files)
+        n_utt_par = np.bincount(self.utt_file[is_par], minlength=n_files)
+        n_occ = []
+        for matcher in matchers:
+            occ = self.utterance_counts(matcher)
+            n_occ.append((
+                np.bincount(self.utt_file[is_chi], weights=occ[is_chi],
+                            minlength=n_files).astype(np.int64),
+                np.bincount(self.utt_file[is_par], weights=occ[is_par],
+                            minlength=n_files).astype(np.int64)))
+
+        file_counts = []
+        for i in range(n_files):
+            age = int(self.file_age[i])
+            if age == NO_AGE:
+                file_counts.append((None, None))
+            elif age > max_age:
+                file_counts.append((age, None))
+            else:
+                file_counts.append((age, [[int(n_occ_chi[i]),
+                                           int(n_utt_chi[i]),
+                                           int(n_occ_par[i]),
+                                           int(n_utt_par[i])]
+                                          for n_occ_chi, n_occ_par in n_occ]))
+        return file_counts
+
+    # Returns the same results dictionary as analyze.count_occurrences_batch:
+    # {query -> {age -> [n_occ_chi, n_utt_chi, n_occ_par, n_utt_par]}}
+    # If a corpus_results dictionary is given, the results of each corpus are
+    # also added to it (see results.add_corpus_counts), and if a file_results
+    # list is given, the (file, age, counts) tuples are appended to it. If
+    # files are given, the other files in the table are ignored.
+    def count_occurrences(self, matchers, results, child, parents,
+                          max_age, corpus_results=None, file_results=None,
+                          files=None):
+        if files is not None:
+            files = set(files)
+        for f, (age, counts) in zip(self.files,
+                                    self.file_counts(matchers, child,
+                                                     parents, max_age)):
+            if files is not None and f not in files:
+                continue
+            if file_results is not None:
+                file_results.append((f, age, counts))
+            if counts is None:
+                continue
+            results = add_counts(results, matchers, age, counts)
+            if corpus_results is not None:
+                add_corpus_counts(corpus_results, f, matchers, age, counts)
+        return results
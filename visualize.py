@@ -1,7 +1,12 @@
 import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 import numpy as np
-import sys
+# Imports from this repository:
+import logsink
+from cube import ResultsCube
+from logsink import logger
 # from enum import Enum
 
 
@@ -16,19 +21,21 @@ EMPTY_MONTH_MSG = 'No {}entries for month {}, query={}.'
 
 def valid(r, query, compare_adult, month, comp_idx):
     if r[month][comp_idx] is None or r[month][comp_idx] <= 0:
-        msg = EMPTY_MONTH_MSG.format('adult ' if compare_adult
-                                     else '', month, query)
-        print(msg)
-        sys.stderr.write(msg + '\n')
+        logger.warning(EMPTY_MONTH_MSG.format('adult ' if compare_adult
+                                              else '', month, query))
         return False
     return True
 
 
+# The results can be a results dictionary or a ResultsCube (see cube.py).
+# If confidence bands are given ({query -> (ages, low, high)}, see
+# bootstrap.confidence_bands), they are drawn around the curves.
 def visualize(results, compare_adult,
-              display=True, filename=None, verbose=True):
+              display=True, filename=None, verbose=True, bands=None):
+    if isinstance(results, ResultsCube):
+        results = results.to_results()
     if verbose:
-        print()
-        print('--- Visualizing', filename)
+        logger.info('\n--- Visualizing %s', filename)
 
     # Set up the plot.
     fig, ax = plt.subplots()
@@ -41,7 +48,7 @@ def visualize(results, compare_adult,
     for (query, r), col in zip(results.items(), colours):
         months = sorted(r.keys())
         if verbose:
-            print(query, [(key, r[key]) for key in months])
+            logger.info('%s %s', query, [(key, r[key]) for key in months])
 
         # Get the dimensions of the graph.
         if min_month == -1 or min_month > months[0]:
@@ -57,7 +64,7 @@ def visualize(results, compare_adult,
                 continue
             months_ok.append(month)
             if verbose:
-                print('month:', month, 'entries:', r[month])
+                logger.info('month: %s entries: %s', month, r[month])
             chi = r[month][0] / r[month][1]
             if compare_adult:
                 if not valid(r, query, compare_adult, month, comp_idx=2):  # >=1 adult utterance?
@@ -67,13 +74,22 @@ def visualize(results, compare_adult,
             entries_ok.append(chi)
 
         if verbose:
-            print('months_ok', months_ok)
-            print('entries_ok', entries_ok)
+            logger.info('months_ok %s\nentries_ok %s', months_ok, entries_ok)
 
         plot, = plt.plot(months_ok, entries_ok, color=col, label=query)
         plots.append(plot)
+        if bands is not None and query in bands:
+            ages, low, high = bands[query]
+            ok = np.isin(ages, months_ok) & np.isfinite(low)
+            ax.fill_between(ages[ok], low[ok], high[ok], color=col,
+                            alpha=0.2, linewidth=0)
 
-    # Prepare the grid and mark full years.
+    format_plot(ax, plots, min_month, max_month, compare_adult)
+    save_plot(display, filename)
+
+
+# Prepares the grid, marks full years and adds the labels and the legend.
+def format_plot(ax, plots, min_month, max_month, compare_adult):
     plt.grid()
     xticks = np.arange(min_month, max_month + 1, step=3).tolist()
     xtick_labels = copy.deepcopy(xticks)
@@ -95,9 +111,58 @@ def visualize(results, compare_adult,
            ylabel=ylabel,
            title='')
     plt.legend(handles=plots, loc=2)
+
+
+def save_plot(display, filename):
     if filename is not None:
         fig = plt.gcf()
         fig.set_size_inches(10, 6)
         fig.savefig(filename + '.png', bbox_inches='tight', dpi=200)
     if display:
         plt.show()
+
+
+# Plots one curve per child for the given matcher (label), from the sessions
+# in a ResultsCube.
+def visualize_children(cube, label, compare_adult,
+                       display=True, filename=None):
+    cube = cube.select(matchers=[label])
+    rates = cube.rates(compare_adult)[0]  # (child, session)
+    fig, ax = plt.subplots()
+    plots = []
+    cmap = plt.get_cmap('jet')
+    colours = cmap(np.linspace(0, 1.0, len(cube.children)))
+    for c, (child, col) in enumerate(zip(cube.children, colours)):
+        ok = np.isfinite(rates[c]) & np.isfinite(cube.ages[c])
+        plot, = plt.plot(cube.ages[c][ok], rates[c][ok], color=col,
+                         marker='o', label=child)
+        plots.append(plot)
+    ages = cube.ages[np.isfinite(cube.ages)]
+    min_month = int(ages.min()) if len(ages) else 0
+    max_month = int(ages.max()) if len(ages) else 0
+    format_plot(ax, plots, min_month, max_month, compare_adult)
+    ax.set(title=label)
+    save_plot(display, filename)
+
+
+def render_plot(plot):
+    results, compare_adult, filename, bands = plot
+    visualize(results, compare_adult, display=False, filename=filename,
+              bands=bands)
+    plt.close('all')
+
+
+def init_plot_worker(*log_args):
+    plt.switch_backend('Agg')  # The plots are only saved.
+    logsink.init_worker(*log_args)
+
+
+# Renders and saves the plots, given as (results, compare_adult, filename,
+# bands) tuples (bands can be None), in parallel worker processes.
+def render_plots(plots, jobs=None):
+    if jobs is None:
+        jobs = min(len(plots), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=init_plot_worker,
+                             initargs=logsink.worker_args()) as executor:
+        list(executor.map(render_plot, plots))
@@ -28,6 +28,23 @@ class Word:
         self.rel = rel
         self.post_rel = post_rel
 
+    # Creates a Word from already split fields (in the order of __slots__).
+    @classmethod
+    def from_fields(cls, form, tag, stem, infl, infl_type, replacement,
+                    rel, post_rel, sfx_form, sfx_tag):
+        word = cls.__new__(cls)
+        word.form = form
+        word.tag = tag
+        word.stem = stem
+        word.infl = infl
+        word.infl_type = infl_type
+        word.replacement = replacement
+        word.rel = rel
+        word.post_rel = post_rel
+        word.sfx_form = sfx_form
+        word.sfx_tag = sfx_tag
+        return word
+
     def __str__(self):
         return '<{}, {}, {} | {}, {} | {} | {}, {} | {}, {}>' \
                .format(self.form, self.tag, self.stem, self.infl,